@@ -0,0 +1,308 @@
+"""
+Benchmarks for the pg!exec sandbox, that run locally without connecting to
+Discord. The results are written as JSON, and can be compared with the results
+of an earlier run to see whether a change to the sandbox made it faster.
+
+Usage: python bench_sandbox.py [-o results.json] [--compare old.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+# pgbot.common needs a token to be importable, it is never used here
+os.environ.setdefault("TOKEN", "")
+
+import psutil
+import pygame
+
+pygame.init()  # pylint: disable=no-member
+pygame.display.set_mode((1, 1))
+
+from pgbot import common, sandbox
+
+CONCURRENCY_LEVELS = (1, 4, 16, 64)
+IMAGE_SIZES = (64, 256, 1024, 2048)
+
+
+def unique_code(code: str):
+    """
+    Make code unique, so that the code and result caches don't skip the work
+    """
+    unique_code.count += 1
+    return f"{code}\n# {unique_code.count}"
+
+
+unique_code.count = 0
+
+
+def summarize(samples):
+    """
+    Get the summary statistics of a list of timings
+    """
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "max": max(samples),
+    }
+
+
+async def bench_cold_spawn(runs: int):
+    """
+    Time starting a new worker and getting the result of a trivial job from it
+    """
+    samples = []
+    for _ in range(runs):
+        job = {
+            "mode": "exec",
+            "code": (await sandbox.code_cache.get(unique_code("pass"))).code,
+            "timeout": 5,
+            "seed": None,
+            "profile": False,
+        }
+        start = time.perf_counter()
+        worker = sandbox.SandboxWorker(common.EXEC_MAX_MEMORY)
+        worker.conn.send(job)
+        await sandbox.wait_for_worker(worker, 5)
+        worker.conn.recv()
+        samples.append(time.perf_counter() - start)
+        worker.kill()
+
+    return summarize(samples)
+
+
+async def bench_first_result(runs: int):
+    """
+    Time exec_sandbox end to end with a warm pool, and the part of that time
+    that is overhead on top of running the code
+    """
+    samples = []
+    overheads = []
+    for _ in range(runs):
+        sandbox.worker_pool.fill()
+        await asyncio.sleep(0.1)  # Let the new workers finish starting
+
+        start = time.perf_counter()
+        output = await sandbox.exec_sandbox(unique_code("print(1)"))
+        total = time.perf_counter() - start
+        samples.append(total)
+        overheads.append(total - output.duration)
+
+    return {"total": summarize(samples), "overhead": summarize(overheads)}
+
+
+async def bench_throughput(jobs_per_level: int):
+    """
+    Run jobs at different numbers of concurrent execs, with the scheduler set
+    up as configured but without queue limits, and report jobs per second
+    """
+    results = {}
+    old_scheduler = sandbox.exec_scheduler
+    sandbox.exec_scheduler = sandbox.ExecScheduler(
+        common.EXEC_MAX_RUNNING, float("inf"), float("inf")
+    )
+    try:
+        for level in CONCURRENCY_LEVELS:
+            total = max(level, jobs_per_level)
+            start = time.perf_counter()
+            for batch in range(0, total, level):
+                await asyncio.gather(*(
+                    sandbox.exec_sandbox(
+                        unique_code("sum(range(10000))"), user_id=i
+                    )
+                    for i in range(batch, min(batch + level, total))
+                ))
+            results[str(level)] = total / (time.perf_counter() - start)
+    finally:
+        sandbox.exec_scheduler = old_scheduler
+
+    return results
+
+
+async def legacy_poll(worker: sandbox.SandboxWorker, timeout: float):
+    """
+    Wait for a worker the way exec_sandbox used to, polling every 50 ms
+    """
+    start = time.perf_counter()
+    while not worker.conn.poll():
+        if start + timeout < time.perf_counter():
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def bench_polling(runs: int):
+    """
+    Compare the wait for a job that takes 10 ms using the old 50 ms polling
+    loop, with the event driven wait
+    """
+    results = {}
+    for name, wait in (
+        ("polling", legacy_poll),
+        ("event", sandbox.wait_for_worker),
+    ):
+        samples = []
+        for _ in range(runs):
+            worker = sandbox.worker_pool.acquire()
+            worker.conn.send({
+                "mode": "exec",
+                "code": (await sandbox.code_cache.get(
+                    unique_code("time.sleep(0.01)")
+                )).code,
+                "timeout": 5,
+                "seed": None,
+                "profile": False,
+            })
+            start = time.perf_counter()
+            await wait(worker, 5)
+            samples.append(time.perf_counter() - start)
+            worker.conn.recv()
+            worker.kill()
+        results[name] = summarize(samples)
+
+    return results
+
+
+async def bench_memory(runs: int):
+    """
+    Measure the memory a worker uses of its own, after running a job
+    """
+    samples = []
+    for _ in range(runs):
+        worker = sandbox.worker_pool.acquire()
+        worker.conn.send({
+            "mode": "exec",
+            "code": (await sandbox.code_cache.get(unique_code("x = 1"))).code,
+            "timeout": 5,
+            "seed": None,
+            "profile": False,
+        })
+        await sandbox.wait_for_worker(worker, 5)
+        worker.conn.recv()
+        samples.append(worker.psproc.memory_full_info().uss)
+        worker.kill()
+
+    return {"uss": summarize(samples)}
+
+
+async def bench_images(runs: int):
+    """
+    Time making an image in the sandbox, getting it back and encoding it, for
+    several surface sizes
+    """
+    results = {}
+    for size in IMAGE_SIZES:
+        code = (
+            f"output.img = pygame.Surface(({size}, {size}))\n"
+            + "output.img.fill((255, 128, 0))\n"
+            + f"pygame.draw.circle(output.img, (0, 0, 255), ({size // 2}, "
+            + f"{size // 2}), {size // 3})"
+        )
+        round_trips = []
+        encodes = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            output = await sandbox.exec_sandbox(unique_code(code))
+            round_trips.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            encoded = sandbox.encode_image(output.img)
+            encodes.append(time.perf_counter() - start)
+
+        results[str(size)] = {
+            "round_trip": summarize(round_trips),
+            "encode": summarize(encodes),
+            "bytes": encoded.buf.getbuffer().nbytes,
+        }
+
+    return results
+
+
+def get_commit():
+    """
+    Get the current git commit, if there is one
+    """
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "--short", "HEAD"),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(runs: int):
+    """
+    Run all the benchmarks
+    """
+    return {
+        "cold_spawn": await bench_cold_spawn(runs),
+        "first_result": await bench_first_result(runs),
+        "throughput": await bench_throughput(runs * 4),
+        "polling": await bench_polling(runs),
+        "memory": await bench_memory(runs),
+        "images": await bench_images(runs),
+    }
+
+
+def flatten(results, prefix=""):
+    """
+    Flatten nested results into "a.b.c": value pairs
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(old, new):
+    """
+    Print every metric of two benchmark runs side by side
+    """
+    old_flat = flatten(old["results"])
+    new_flat = flatten(new["results"])
+    print(f"{'metric':<40}{old['commit'] or 'old':>14}{new['commit'] or 'new':>14}{'ratio':>8}")
+    for key, value in new_flat.items():
+        if key not in old_flat:
+            continue
+        ratio = value / old_flat[key] if old_flat[key] else float("nan")
+        print(f"{key:<40}{old_flat[key]:>14.6g}{value:>14.6g}{ratio:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-o", "--output", help="file to write the JSON to")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare")
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    results = {
+        "commit": get_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": psutil.cpu_count(),
+        "results": asyncio.run(run_benchmarks(args.runs)),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Build step that imports the modules pg!doc documents once, and writes their
+docs into the SQLite snapshot the bot reads them from. With the snapshot, the
+bot serves those docs without importing the modules. Run it again after
+upgrading any of them, the bot ignores the docs of modules whose installed
+version changed.
+
+Usage: python build_docs.py [-o docs.sqlite]
+"""
+import argparse
+import builtins
+import importlib
+import os
+import time
+import warnings
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+# pgbot.common needs a token to be importable, it is never used here
+os.environ.setdefault("TOKEN", "")
+
+from pgbot import common, docs
+
+
+def get_roots():
+    """
+    Import the modules pg!doc documents, and get them as (name, module)
+    pairs, with builtins under the name ""
+    """
+    roots = [("", builtins)]
+    for name in docs.doc_module_names:
+        try:
+            roots.append((name, importlib.import_module(name)))
+        except BaseException as exc:
+            print(f"Skipping {name}: {exc.__class__.__name__}: {exc}")
+    return roots
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-o", "--output", default=common.DOC_SNAPSHOT_PATH,
+        help="file to write the snapshot to"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        # Reading deprecated attributes warns, they are still documented
+        warnings.simplefilter("ignore")
+        roots = get_roots()
+        docs.write_snapshot(args.output, roots)
+
+    print(
+        f"Wrote the docs of {len(roots)} modules to {args.output} in "
+        f"{time.perf_counter() - start:.1f} s, "
+        f"{os.path.getsize(args.output) / 2 ** 20:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ import random
 import discord
 import pygame
 
-from pgbot import commands, common, emotion, utils, embed_utils
+from pgbot import commands, common, docs, emotion, outbound, sandbox, utils, embed_utils
 
 
 @common.bot.event
@@ -33,6 +33,9 @@ async def on_ready():
                 if channel.id == value:
                     common.entry_channels[key] = channel
 
+    docs.symbol_index.start()
+    embed_utils.reaction_router.restore(common.PAGINATOR_STORE_PATH)
+
     while True:
         await common.bot.change_presence(
             activity=discord.Activity(
@@ -74,8 +77,10 @@ async def on_member_join(member: discord.Member):
 
             if not member.pending:
                 # Don't use embed here, because pings would not work
-                await common.arrivals_channel.send(
-                    f"{greet} {member.mention}! {check} "
+                await outbound.send(
+                    common.arrivals_channel,
+                    outbound.FORWARDING,
+                    content=f"{greet} {member.mention}! {check} "
                     + f"{common.guide_channel.mention}{grab} "
                     + f"{common.roles_channel.mention}{end}"
                 )
@@ -86,6 +91,15 @@ async def on_member_join(member: discord.Member):
     bot_sus = discord.utils.get(member.guild.roles, id=common.BOT_SUS_ROLE)
     await member.add_roles(bot_sus)
 
+@common.bot.event
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    """
+    This function is called for every reaction, and sends the reactions on
+    paged embeds to them
+    """
+    await embed_utils.reaction_router.dispatch(payload)
+
+
 @common.bot.event
 async def on_message(msg: discord.Message):
     """
@@ -136,7 +150,8 @@ async def on_message(msg: discord.Message):
             title,
             "",
             color,
-            fields=fields
+            fields=fields,
+            priority=outbound.FORWARDING
         )
 
 
@@ -177,4 +192,9 @@ if __name__ == "__main__":
     os.environ["SDL_VIDEODRIVER"] = "dummy"
     pygame.init()  # pylint: disable=no-member
     common.window = pygame.display.set_mode((1, 1))
+    # Start the first pg!exec workers before the bot connects, so that the
+    # first commands don't wait for workers to start. The workers that later
+    # refill the pool are forked from the running bot, and do inherit its
+    # connections
+    sandbox.worker_pool.fill()
     common.bot.run(common.TOKEN)
@@ -0,0 +1,269 @@
+"""
+Animated output of pg!exec. Frames are recorded and encoded as a GIF inside
+the sandbox worker, so that the work counts against the limits of the job
+"""
+import struct
+
+import numpy
+import pygame
+
+
+class FrameRecorder:
+    """
+    output.frames in the sandbox. Keeps only the part of every frame that
+    changed from the frame before it, and enforces the frame count and byte
+    limits while the frames come in
+    """
+
+    def __init__(self, max_frames: int, max_bytes: int, duration: int):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.duration = duration  # Milliseconds every frame is shown for
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all frames
+        """
+        self.size = None
+        # [x, y, pixels, unchanged mask or None, number of frames it lasts]
+        self.frames = []
+        self.previous = None
+        self.nbytes = 0
+        self.dropped = 0
+
+    def append(self, surf: pygame.Surface):
+        """
+        Add a copy of a surface as the next frame
+        """
+        if not isinstance(surf, pygame.Surface):
+            raise TypeError("frames must be pygame surfaces")
+
+        if self.size is not None and surf.get_size() != self.size:
+            raise ValueError("all frames must have the same size")
+
+        if (
+            len(self.frames) >= self.max_frames
+            or self.nbytes >= self.max_bytes
+        ):
+            self.dropped += 1
+            return
+
+        width, height = surf.get_size()
+        if not width or not height:
+            raise ValueError("frames can't be empty")
+
+        pixels = numpy.frombuffer(
+            pygame.image.tostring(surf, "RGB"), numpy.uint8
+        ).reshape(height, width, 3)
+
+        if self.previous is None:
+            x, y, region, unchanged = 0, 0, pixels, None
+        else:
+            changed = numpy.any(pixels != self.previous, axis=2)
+            rows = numpy.flatnonzero(changed.any(axis=1))
+            if not rows.size:
+                # Same as the last frame, show that one for longer
+                self.frames[-1][4] += 1
+                return
+
+            cols = numpy.flatnonzero(changed.any(axis=0))
+            y, x = rows[0], cols[0]
+            box = (slice(y, rows[-1] + 1), slice(x, cols[-1] + 1))
+            region, unchanged = pixels[box], ~changed[box]
+
+        nbytes = region.nbytes + (0 if unchanged is None else unchanged.nbytes)
+        if self.nbytes + nbytes > self.max_bytes:
+            self.dropped += 1
+            return
+
+        self.size = (width, height)
+        self.frames.append([int(x), int(y), region, unchanged, 1])
+        self.previous = pixels
+        self.nbytes += nbytes
+
+    def extend(self, surfs):
+        """
+        Add several frames
+        """
+        for surf in surfs:
+            self.append(surf)
+
+    def __len__(self):
+        return sum(frame[4] for frame in self.frames)
+
+
+def lzw_compress(indices: bytes, min_code_size: int = 8):
+    """
+    Compress palette indices with the LZW variant of GIF, and return the
+    packed bits
+    """
+    clear = 1 << min_code_size
+    first_code = clear + 2
+    out = bytearray()
+    acc = clear  # Every image starts with a clear code
+    nbits = code_size = min_code_size + 1
+    table = {}
+    next_code = first_code
+
+    prefix = indices[0]
+    for byte in indices[1:]:
+        key = (prefix << 8) | byte
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        acc |= prefix << nbits
+        nbits += code_size
+        while nbits >= 8:
+            out.append(acc & 0xFF)
+            acc >>= 8
+            nbits -= 8
+
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > 1 << code_size and code_size < 12:
+                code_size += 1
+        else:
+            # The table is full, start over
+            acc |= clear << nbits
+            nbits += code_size
+            table.clear()
+            next_code = first_code
+            code_size = min_code_size + 1
+
+        prefix = byte
+
+    for code in (prefix, clear + 1):  # The last prefix, and the end code
+        acc |= code << nbits
+        nbits += code_size
+
+    while nbits > 0:
+        out.append(acc & 0xFF)
+        acc >>= 8
+        nbits -= 8
+
+    return bytes(out)
+
+
+def to_sub_blocks(data: bytes):
+    """
+    Split data into the length prefixed blocks of GIF
+    """
+    blocks = [
+        bytes((len(data[i:i + 255]),)) + data[i:i + 255]
+        for i in range(0, len(data), 255)
+    ]
+    return b"".join(blocks) + b"\x00"
+
+
+def to_color_keys(region: numpy.ndarray):
+    """
+    Pack RGB pixels into one integer per pixel
+    """
+    return (region.astype(numpy.uint32) * (1 << 16, 1 << 8, 1)).sum(axis=2)
+
+
+def get_palette(frames: list):
+    """
+    Get a palette of at most 255 colors shared by all frames, the last index
+    is kept for transparency. Returns the palette, and a function that maps
+    the pixels of a frame to palette indices. Frames with more colors are
+    mapped to a fixed 6x7x6 palette
+    """
+    # Most frames with too many colors are caught by a small sample, without
+    # going through all the pixels
+    sample = numpy.concatenate([
+        to_color_keys(region[::8, ::8]).ravel()
+        for _, _, region, _, _ in frames
+    ])
+    colors = numpy.unique(sample[::max(len(sample) // 4096, 1)])
+    for _, _, region, _, _ in frames:
+        if len(colors) > 255:
+            break
+        colors = numpy.union1d(colors, to_color_keys(region))
+
+    if len(colors) <= 255:
+        palette = numpy.stack(
+            (colors >> 16, (colors >> 8) & 0xFF, colors & 0xFF), axis=1
+        )
+
+        def to_indices(region):
+            keys = to_color_keys(region)
+            return numpy.searchsorted(colors, keys).astype(numpy.uint8)
+
+        return palette, to_indices
+
+    levels = numpy.array((6, 7, 6))
+    palette = numpy.stack(numpy.meshgrid(
+        *(numpy.linspace(0, 255, n).round() for n in levels), indexing="ij"
+    ), axis=3).reshape(-1, 3)
+
+    def to_indices(region):
+        steps = (region * (levels - 1) + 127) // 255
+        return (
+            (steps * (levels[1] * levels[2], levels[2], 1))
+            .sum(axis=2).astype(numpy.uint8)
+        )
+
+    return palette, to_indices
+
+
+def encode_gif(recorder: FrameRecorder, max_bytes: int):
+    """
+    Encode the frames of a recorder as a looping GIF, with a shared palette
+    and only the changed part of each frame. Frames that would make the file
+    bigger than max_bytes are dropped. Returns (GIF bytes, dropped frames),
+    the GIF is None if no frame fits
+    """
+    width, height = recorder.size
+    palette, to_indices = get_palette(recorder.frames)
+    transparent = 255
+
+    table = numpy.zeros((256, 3), numpy.uint8)
+    table[:len(palette)] = palette
+
+    parts = [
+        b"GIF89a",
+        # Screen size, and a global color table of 256 entries
+        struct.pack("<HHBBB", width, height, 0xF7, 0, 0),
+        table.tobytes(),
+        # Loop forever
+        b"\x21\xFF\x0BNETSCAPE2.0\x03\x01\x00\x00\x00",
+    ]
+    size = sum(map(len, parts)) + 1
+    dropped = recorder.dropped
+
+    for i, (x, y, region, unchanged, length) in enumerate(recorder.frames):
+        frame_indices = to_indices(region)
+        if unchanged is not None:
+            frame_indices[unchanged] = transparent
+
+        delay = min(recorder.duration * length // 10, 0xFFFF)
+        frame_height, frame_width = frame_indices.shape
+        frame = b"".join((
+            # Keep the frame when drawing the next one on top, with the
+            # unchanged pixels transparent
+            struct.pack(
+                "<BBBBHBB", 0x21, 0xF9, 4, 0x05, delay, transparent, 0
+            ),
+            struct.pack("<BHHHHB", 0x2C, x, y, frame_width, frame_height, 0),
+            b"\x08",
+            to_sub_blocks(lzw_compress(frame_indices.tobytes())),
+        ))
+
+        if size + len(frame) > max_bytes:
+            dropped += sum(rest[4] for rest in recorder.frames[i:])
+            break
+
+        parts.append(frame)
+        size += len(frame)
+
+    if len(parts) == 4:
+        # Not even the first frame fits
+        return None, dropped
+
+    parts.append(b"\x3B")
+    return b"".join(parts), dropped
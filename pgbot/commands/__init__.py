@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import discord
 
-from pgbot import common, embed_utils
+from pgbot import common, embed_utils, outbound, utils
 from pgbot.commands import admin, user
 
 
@@ -13,7 +13,8 @@ async def handle(invoke_msg: discord.Message, response_msg: discord.Message):
     await embed_utils.send(
         common.log_channel,
         f"Command invoked by {invoke_msg.author} / {invoke_msg.author.id}",
-        invoke_msg.content
+        invoke_msg.content,
+        priority=outbound.LOGS
     )
 
     is_priv = False
@@ -35,3 +36,36 @@ async def handle(invoke_msg: discord.Message, response_msg: discord.Message):
         return
 
     await cmd.handle_cmd()
+
+
+def is_admin(member):
+    """
+    Whether a member can use admin commands. Members that are only known by
+    id are admins if they are admin users
+    """
+    if member.id in common.ADMIN_USERS:
+        return True
+
+    return any(
+        role.id in common.ADMIN_ROLES for role in getattr(member, "roles", ())
+    )
+
+
+async def resume_help(args, message, caller, page):
+    """
+    Build the PagedEmbed of pg!help again, for a stored PagedEmbed, with the
+    commands its caller can use
+    """
+    command_class = user.UserCommand
+    if caller is not None and is_admin(caller):
+        command_class = admin.AdminCommand
+
+    functions = {
+        name[len("cmd_"):]: getattr(command_class, name)
+        for name in dir(command_class)
+        if name.startswith("cmd_")
+    }
+    return await utils.get_help_embed(message, caller, functions, page)
+
+
+embed_utils.page_sources["help"] = resume_help
@@ -7,7 +7,7 @@ import time
 import discord
 import psutil
 
-from pgbot import common, embed_utils, utils
+from pgbot import common, docs, embed_utils, outbound, utils
 from pgbot.commands.base import CodeBlock, String, MentionableID
 from pgbot.commands.user import UserCommand
 from pgbot.commands.emsudo import EmsudoCommand
@@ -213,10 +213,14 @@ class AdminCommand(UserCommand, EmsudoCommand):
         Implement pg!heap, for admins to check memory taken up by the bot
         """
         mem = process.memory_info().rss
+        cache = docs.doc_cache
         await embed_utils.replace(
             self.response_msg,
             "Total memory used:",
-            f"**{utils.format_byte(mem, 4)}**\n({mem} B)"
+            f"**{utils.format_byte(mem, 4)}**\n({mem} B)\n"
+            + f"pg!doc cache: {len(cache.pages)} docs in "
+            + f"{utils.format_byte(cache.size, 4)}, {cache.hits} hits, "
+            + f"{cache.misses} misses"
         )
 
     async def cmd_stop(self):
@@ -294,7 +298,9 @@ class AdminCommand(UserCommand, EmsudoCommand):
         archive_list = utils.split_long_message(archive_str)
 
         for message in archive_list:
-            await destination_channel.send(message)
+            await outbound.send(
+                destination_channel, outbound.BULK, content=message
+            )
 
         await embed_utils.replace(
             self.response_msg,
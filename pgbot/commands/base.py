@@ -310,7 +310,7 @@ class OldBaseCommand:
         Must return True on successful command execution, False otherwise
         """
         self.args = self.cmd_str.split()
-        cmd = re.sub(r'\s'. '', self.args.pop(0)) if self.args else ""
+        cmd = re.sub(r'\s', '', self.args.pop(0)) if self.args else ""
         self.string = self.cmd_str[len(cmd):].strip()
 
         title = "Unrecognized command!"
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import asyncio
+import io
 import os
 import random
 import re
@@ -63,16 +65,61 @@ class UserCommand(BaseCommand):
         """
         await self._cmd_doc(name)
 
-    async def cmd_exec(self, code: CodeBlock):
+    async def cmd_docsearch(self, query: str):
+        """
+        ->type Get help
+        ->signature pg!docsearch [query]
+        ->description Search for names that pg!doc can document, e.g. pg!docsearch pygame.Rect.collide
+        -----
+        Implement pg!docsearch, to find names for pg!doc
+        """
+        # Names outside the snapshot are only indexed once their module is
+        # imported
+        root = query.split(".")[0]
+        entry = docs.module_index.get(root)
+        if entry is not None and not docs.snapshot.covers(root):
+            await docs.module_index.load(entry)
+
+        results = docs.symbol_index.search(query, common.DOC_SEARCH_LIMIT)
+        note = ""
+        if docs.symbol_index.building:
+            note = "\nSome modules are still being indexed, try again soon."
+
+        if not results:
+            await embed_utils.replace(
+                self.response_msg,
+                "No results!",
+                f"Nothing like `{query}` was found." + note
+            )
+            return
+
+        await embed_utils.replace(
+            self.response_msg,
+            f"Search results for `{query}`",
+            utils.code_block("\n".join(results)) + note
+        )
+
+    async def cmd_exec(
+        self,
+        code: CodeBlock,
+        seed: int = None,
+        profile: bool = False,
+        cache: bool = False,
+    ):
         """
         ->type Run code
-        ->signature pg!exec [python code block]
+        ->signature pg!exec [python code block] [seed] [profile] [cache]
         ->description Run python code in an isolated environment.
         ->extended description
         Import is not available. Various methods of builtin objects have been disabled for security reasons.
         The available preimported modules are:
-        `math, cmath, random, re, time, string, itertools, pygame`
-        To show an image, overwrite `output.img` to a surface (see example command).
+        `math, cmath, random, re, time, string, itertools, pygame, numpy (np)`
+        For fast pixel work, `pygame.surfarray` converts between surfaces and numpy arrays. Functions of numpy that use files are not available.
+        To show an image, overwrite `output.img` to a surface (see example command). Images too big to upload are sent as JPEG or scaled down.
+        To show an animation, add frames with `output.frames.append(surface)` (or assign a list of surfaces to `output.frames`), and set the milliseconds a frame is shown with `output.frames.duration`. It is sent as a GIF.
+        Pass `seed=<number>` to seed `random` and `np.random` before the code runs, so that the results are repeatable.
+        Pass `profile=True` to get a report of the CPU time, memory use and the slowest functions of your code.
+        Pass `cache=True` to reuse the output of an earlier run of the same code, when the code doesn't use `time` or unseeded `random`.
         To make it easier to read and write code use code blocks (see [HERE](https://discord.com/channels/772505616680878080/774217896971730974/785510505728311306)).
         ->example command pg!exec \\`\\`\\`py ```py
         # Draw a red rectangle on a transparent surface
@@ -83,17 +130,47 @@ class UserCommand(BaseCommand):
         -----
         Implement pg!exec, for execution of python code
         """
-        tstamp = time.perf_counter_ns()
         returned = await sandbox.exec_sandbox(
-            code.code, tstamp, 10 if self.is_priv else 5
+            code.code,
+            10 if self.is_priv else 5,
+            user_id=self.invoke_msg.author.id,
+            is_priv=self.is_priv,
+            on_queued=self._on_exec_queued,
+            seed=seed,
+            profile=profile,
+            cache=cache,
+        )
+        await self._send_exec_output(returned)
+
+    async def _on_exec_queued(self, position: int):
+        """
+        Tell the user that their code is waiting in the pg!exec queue
+        """
+        await embed_utils.replace(
+            self.response_msg,
+            "Your code is queued!",
+            f"It is at position {position} in the queue, it will run soon"
         )
+
+    async def _send_exec_output(self, returned: sandbox.Output):
+        """
+        Send the output of code run by pg!exec or pg!session
+        """
         dur = returned.duration  # the execution time of the script alone
 
         if returned.exc is None:
             if returned.img:
-                if os.path.getsize(f"temp{tstamp}.png") < 2 ** 22:
+                # Encode in a thread, so that big images don't block the bot
+                img = await asyncio.get_event_loop().run_in_executor(
+                    None, sandbox.encode_image, returned.img
+                )
+                if img is not None:
+                    note = None
+                    if img.size != returned.img.size:
+                        width, height = img.size
+                        note = f"The image was scaled down to {width}x{height}"
                     await self.response_msg.channel.send(
-                        file=discord.File(f"temp{tstamp}.png")
+                        note, file=discord.File(img.buf, img.filename)
                     )
                 else:
                     await embed_utils.replace(
@@ -101,11 +178,36 @@ class UserCommand(BaseCommand):
                         "Image cannot be sent:",
                         "The image file size is above 4MiB",
                     )
-                os.remove(f"temp{tstamp}.png")
+
+            if returned.animation is not None:
+                note = None
+                if returned.dropped_frames:
+                    note = f"{returned.dropped_frames} frames were cut off"
+                await self.response_msg.channel.send(
+                    note,
+                    file=discord.File(
+                        io.BytesIO(returned.animation), "output.gif"
+                    )
+                )
+            elif returned.dropped_frames:
+                await self.response_msg.channel.send(
+                    "The animation is too big to be sent"
+                )
+
+            if returned.profile:
+                await self.response_msg.channel.send(
+                    file=discord.File(
+                        io.BytesIO(returned.profile.encode()), "profile.txt"
+                    )
+                )
+
+            title = f"Returned text (code executed in {utils.format_time(dur)}"
+            if returned.truncated:
+                title += f", {returned.truncated} characters cut off"
 
             await embed_utils.replace(
                 self.response_msg,
-                f"Returned text (code executed in {utils.format_time(dur)}):",
+                title + "):",
                 utils.code_block(returned.text)
             )
 
@@ -116,6 +218,127 @@ class UserCommand(BaseCommand):
                 utils.code_block(", ".join(map(str, returned.exc.args)))
             )
 
+    async def cmd_session(self, code: CodeBlock):
+        """
+        ->type Run code
+        ->signature pg!session [python code block]
+        ->description Run python code in your own session, that remembers its globals.
+        ->extended description
+        Works like pg!exec, but the globals defined by your code (surfaces, fonts, functions...) are kept for the next pg!session, so you don't need to run your setup code again.
+        A session is closed after 10 minutes without use, when it runs out of time or memory, or when too many people have one open. Use pg!session_reset to start over.
+        ->example command pg!session \\`\\`\\`py ```py
+        # Set up once, and then draw in the next pg!session
+        surf = pygame.Surface((200, 200))
+        def draw(color):
+            surf.fill(color)
+            output.img = surf```
+        \\`\\`\\`
+        -----
+        Implement pg!session, for execution of python code in a session
+        """
+        returned = await sandbox.exec_session(
+            code.code,
+            10 if self.is_priv else 5,
+            user_id=self.invoke_msg.author.id,
+            is_priv=self.is_priv,
+            on_queued=self._on_exec_queued,
+        )
+        await self._send_exec_output(returned)
+
+    async def cmd_session_reset(self):
+        """
+        ->type Run code
+        ->signature pg!session_reset
+        ->description Close your pg!session, forgetting its globals
+        -----
+        Implement pg!session_reset, to close a pg!session
+        """
+        if sandbox.session_manager.close(self.invoke_msg.author.id):
+            await embed_utils.replace(
+                self.response_msg,
+                "Session reset",
+                "Your session was closed, the next pg!session starts a new one"
+            )
+        else:
+            await embed_utils.replace(
+                self.response_msg,
+                "No session",
+                "You don't have a session open"
+            )
+
+    async def cmd_timeit(
+        self,
+        first: CodeBlock,
+        second: CodeBlock = None,
+        third: CodeBlock = None,
+    ):
+        """
+        ->type Run code
+        ->signature pg!timeit [setup code block] [statement code block] [other statement code block]
+        ->description Time python code in an isolated environment.
+        ->extended description
+        With one code block, that code is timed. With two, the first one is setup code that is run before timing the second one.
+        With three, the last two are timed after the same setup and compared side by side.
+        The number of loops is picked automatically, and the statements are timed in repeated trials.
+        The same restrictions as `pg!exec` apply.
+        ->example command pg!timeit \\`\\`\\`py ```py
+        nums = list(range(1000))```
+        \\`\\`\\` \\`\\`\\`py ```py
+        sum(nums)```
+        \\`\\`\\` \\`\\`\\`py ```py
+        sum(i for i in nums)```
+        \\`\\`\\`
+        -----
+        Implement pg!timeit, for timing python code
+        """
+        if second is None:
+            setup, stmts = "pass", [first.code]
+        else:
+            setup, stmts = first.code, [second.code]
+            if third is not None:
+                stmts.append(third.code)
+
+        returned = await sandbox.timeit_sandbox(
+            setup,
+            stmts,
+            10 if self.is_priv else 5,
+            user_id=self.invoke_msg.author.id,
+            is_priv=self.is_priv,
+            on_queued=self._on_exec_queued,
+        )
+
+        if returned.exc is not None:
+            await embed_utils.replace(
+                self.response_msg,
+                common.EXC_TITLES[1],
+                utils.code_block(", ".join(map(str, returned.exc.args)))
+            )
+            return
+
+        table = f"{'':<11}{'loops':>10}{'trials':>8}{'min':>13}{'median':>13}{'stdev':>13}\n"
+        for i, (number, trials, best, median, stdev) in enumerate(
+            returned.timings, 1
+        ):
+            table += (
+                f"{f'Statement {i}':<11}{number:>10}{trials:>8}"
+                + f"{utils.format_time(best, 3):>13}"
+                + f"{utils.format_time(median, 3):>13}"
+                + f"{utils.format_time(stdev, 3):>13}\n"
+            )
+
+        if len(returned.timings) == 2:
+            ratio = returned.timings[1][3] / returned.timings[0][3]
+            if ratio >= 1:
+                table += f"\nStatement 2 is {ratio:.2f}x slower than statement 1"
+            else:
+                table += f"\nStatement 2 is {1 / ratio:.2f}x faster than statement 1"
+
+        await embed_utils.replace(
+            self.response_msg,
+            "Timing results (time per loop):",
+            utils.code_block(table)
+        )
+
     async def _cmd_help(self, argname, page=0, msg=None):
         """
         Helper function for pg!help, handle pg!refresh stuff
@@ -256,6 +479,19 @@ class UserCommand(BaseCommand):
         -----
         Implement pg!refresh, to refresh a message which supports pages
         """
+        # Paged messages that are stored are built again from their state,
+        # without fetching the message
+        state = embed_utils.reaction_router.get_state(msg_id)
+        if state is not None and state.channel_id == self.invoke_msg.channel.id:
+            page_embed = await embed_utils.reaction_router.resume(
+                state, self.invoke_msg.author
+            )
+            if page_embed is not None:
+                await self.response_msg.delete()
+                await self.invoke_msg.delete()
+                await page_embed.mainloop()
+                return
+
         try:
             msg = await self.invoke_msg.channel.fetch_message(msg_id)
         except (discord.errors.NotFound, discord.errors.HTTPException):
@@ -115,6 +115,121 @@ ZERO_SPACE = "\u200b"  # U+200B
 
 DOC_EMBED_LIMIT = 3
 
+# Seconds a paged embed keeps its buttons without any reactions
+PAGED_EMBED_TIMEOUT = 60
+
+# The states of paged embeds are kept here, so that they work after a restart
+PAGINATOR_STORE_PATH = "paginators.sqlite"
+PAGINATOR_STORE_MAX_ROWS = 10000
+
+# Requests per seconds of each route the bot sends to, from the limits Discord
+# documents. A route is paused for longer when Discord rate limits it anyway
+OUTBOUND_ROUTE_LIMITS = {
+    "send": (5, 5.0),
+    "edit": (5, 5.0),
+    "reaction": (1, 0.25),
+}
+OUTBOUND_GLOBAL_LIMIT = (50, 1.0)
+# Global tokens bulk requests leave for the other priority classes
+OUTBOUND_BULK_RESERVE = 10
+
+# Number of bytes of rendered pg!doc pages kept in the cache
+DOC_CACHE_BYTES = 2 ** 21
+
+# Number of objects whose member categories pg!doc keeps
+DOC_MEMBER_CACHE_SIZE = 256
+
+# Prebuilt pg!doc docs written by build_docs.py, and the number of bytes of it
+# SQLite may memory map
+DOC_SNAPSHOT_PATH = "docs.sqlite"
+DOC_SNAPSHOT_MMAP_SIZE = 2 ** 26
+
+# The pg!doc symbol index walks this many objects before letting other tasks
+# run, and goes at most this many attributes deep into a module
+DOC_INDEX_CHUNK = 256
+DOC_INDEX_MAX_DEPTH = 3
+
+# Number of results of pg!docsearch, and of "did you mean" suggestions of
+# pg!doc. Suggestions need at least DOC_SUGGEST_MIN_SCORE trigram similarity
+DOC_SEARCH_LIMIT = 15
+DOC_SUGGEST_LIMIT = 3
+DOC_SUGGEST_MIN_SCORE = 0.4
+
+# Number of warm pg!exec sandbox workers kept ready, and the number of jobs a
+# worker runs before being replaced
+EXEC_POOL_SIZE = 2
+EXEC_WORKER_MAX_JOBS = 1
+
+# Interval in seconds at which the memory of running pg!exec workers is checked,
+# only used on platforms without kernel resource limits
+EXEC_MONITOR_INTERVAL = 0.1
+
+# Kernel limits for pg!exec workers: memory in bytes and the number of files a
+# worker may open on top of the ones it inherits
+EXEC_MAX_MEMORY = 2 ** 28
+EXEC_MAX_FILES = 16
+
+# Number of compiled pg!exec snippets kept in the code cache
+EXEC_CODE_CACHE_SIZE = 64
+
+# Results of deterministic pg!exec code are cached: the number of results,
+# seconds they stay fresh and total bytes of text and images kept. Code using
+# these modules is not deterministic, unless it is run with a fixed seed
+EXEC_RESULT_CACHE_SIZE = 64
+EXEC_RESULT_CACHE_TTL = 600
+EXEC_RESULT_CACHE_BYTES = 2 ** 24
+EXEC_NONDETERMINISTIC_NAMES = ("random", "time")
+# Random generators that seed themselves from OS entropy, even when the job
+# runs with a fixed seed
+EXEC_UNSEEDED_NAMES = (
+    "default_rng", "Generator", "SeedSequence", "RandomState", "BitGenerator",
+    "MT19937", "PCG64", "PCG64DXSM", "Philox", "SFC64", "Random",
+    "SystemRandom",
+)
+
+# pg!session limits: the number of sessions open at once, the seconds a
+# session stays open without being used, and the memory of a session worker
+EXEC_MAX_SESSIONS = 4
+EXEC_SESSION_IDLE_TIMEOUT = 600
+EXEC_SESSION_MAX_MEMORY = 2 ** 28
+
+# Maximum number of characters of text output kept from a pg!exec job
+EXEC_MAX_OUTPUT = 2048
+
+# Characters of pg!exec code the bot parses at all, longer code is rejected
+EXEC_MAX_CODE_LENGTH = 2 ** 16
+
+# Largest width and height of a pg!exec image, bigger images are scaled down
+# in the worker before they are sent to the bot
+EXEC_MAX_IMAGE_SIZE = 4096
+
+# Upload budget for a pg!exec image, it is reencoded or scaled down to fit
+EXEC_MAX_IMAGE_BYTES = 2 ** 22
+
+# Limits of output.frames in pg!exec, the number of frames kept and the bytes
+# of pixels they take before being encoded, and the default frame duration in
+# milliseconds
+EXEC_MAX_FRAMES = 300
+EXEC_MAX_FRAME_BYTES = 2 ** 25
+EXEC_FRAME_DURATION = 100
+
+# Number of functions shown in the pg!exec profile report
+EXEC_PROFILE_TOP = 20
+
+# Number of trials pg!timeit aims to run for every statement
+TIMEIT_MIN_TRIALS = 5
+TIMEIT_MAX_TRIALS = 50
+
+# Admission control for pg!exec: jobs running at once, jobs allowed to wait in
+# total and jobs allowed to wait per user
+EXEC_MAX_RUNNING = 2
+EXEC_MAX_QUEUED = 10
+EXEC_MAX_QUEUED_PER_USER = 2
+
+# Optional cgroup v2 directory delegated to the bot, every pg!exec worker gets
+# its own group in it with a memory.max limit
+EXEC_CGROUP = os.environ.get("EXEC_CGROUP")
+
 ROLE_PROMPT = {
     "title": [
         "Get more roles",
@@ -167,9 +282,37 @@ BOT_WELCOME_MSG = {
 
 ILLEGAL_ATTRIBUTES = (
     "__subclasses__", "__loader__", "__bases__", "__code__",
-    "__getattribute__", "__setattr__", "__delattr_", "mro",
-    "__class__", "__dict__"
+    "__getattribute__", "__setattr__", "__delattr__", "mro",
+    "__class__", "__dict__", "__globals__", "__builtins__",
+    "__traceback__", "tb_frame", "gi_frame", "cr_frame", "ag_frame",
+    "f_back", "f_globals", "f_locals", "f_builtins", "__self__",
+    "__getattr__", "__array_interface__", "__array_struct__", "__import__",
+    "__base__",
+)
+
+# Attributes of numpy arrays that reach raw memory or write files. These are
+# common words, so they are only rejected when looked up as attributes, not
+# as plain names
+ILLEGAL_NUMPY_ATTRIBUTES = ("ctypes", "tofile", "dump")
+
+# numpy names that are left out of the sandbox, because they read or write
+# files, reach raw memory or configure the process. Submodules are left out
+# too, except for the ones listed in EXEC_NUMPY_SUBMODULES. The names in the
+# last two lines only exist in numpy 1.x, they are blocked in case an older
+# numpy is installed than requirements.txt asks for
+EXEC_NUMPY_BLOCKED = (
+    "load", "save", "savez", "savez_compressed", "loadtxt", "savetxt",
+    "genfromtxt", "fromfile", "fromregex", "memmap", "ctypeslib",
+    "from_dlpack", "get_include", "show_config", "show_runtime", "info",
+    "test", "setbufsize", "seterrcall", "geterrcall",
+    "DataSource", "recfromtxt", "recfromcsv", "ndfromtxt", "mafromtxt",
+    "lookfor", "source", "who", "disp", "safe_eval", "deprecate",
 )
+EXEC_NUMPY_SUBMODULES = ("linalg", "fft", "random", "emath")
+
+# Packages whose already loaded modules can be imported by numpy and pygame
+# internals that run in the sandbox, like ndarray.mean
+EXEC_INTERNAL_IMPORTS = ("numpy", "pygame")
 
 BOT_HELP_PROMPT = {
     "title": "Help",
@@ -1,124 +1,1033 @@
 import asyncio
+import bisect
 import builtins
-import cmath
 import collections
-import gc
+import difflib
+import heapq
 import importlib
-import itertools
+import importlib.metadata
+import importlib.util
+import inspect
 import json
-import math
 import os
-import pickle
-import random
-import re
-import socket
 import sqlite3
-import string
 import sys
-import threading
 import time
-import timeit
 import types
+import zlib
 
-import discord
-import numpy
-import pkg_resources
 import pygame
 import pygame._sdl2
 import pygame.gfxdraw
-import pygame_gui
 
 from . import common, utils, embed_utils
 
-doc_module_tuple = (
-    asyncio,
-    builtins,
-    cmath,
-    collections,
-    discord,
-    gc,
-    itertools,
-    json,
-    math,
-    numpy,
-    os,
-    pickle,
-    pygame,
-    pygame_gui,
-    random,
-    re,
-    socket,
-    sqlite3,
-    string,
-    sys,
-    threading,
-    time,
-    timeit,
+# Modules that can always be documented, even if they don't come from an
+# installed distribution
+doc_module_names = (
+    "asyncio",
+    "builtins",
+    "cmath",
+    "collections",
+    "discord",
+    "gc",
+    "itertools",
+    "json",
+    "math",
+    "numpy",
+    "os",
+    "pickle",
+    "pygame",
+    "pygame_gui",
+    "random",
+    "re",
+    "socket",
+    "sqlite3",
+    "string",
+    "sys",
+    "threading",
+    "time",
+    "timeit",
 )
-doc_module_dict = {}
 
-for module_obj in doc_module_tuple:
-    doc_module_dict[module_obj.__name__] = module_obj
 
-for module in sys.modules:
-    doc_module_dict[module] = sys.modules[module]
+class ModuleEntry:
+    """
+    A module that pg!doc knows about. It is imported the first time its docs
+    are asked for, and the time that took, or the error it failed with, is
+    kept
+    """
+
+    def __init__(self, name: str, distribution: str = None):
+        self.name = name
+        self.distribution = distribution
+        self.module = None
+        self.import_time = None
+        self.error = None
+
+
+def get_top_level_names(dist: importlib.metadata.Distribution):
+    """
+    Get the names of the top level modules of a distribution, from its
+    metadata, without importing anything
+    """
+    text = dist.read_text("top_level.txt")
+    if text:
+        return text.split()
+
+    names = set()
+    for path in dist.files or ():
+        top = path.parts[0]
+        if len(path.parts) == 1:
+            top = inspect.getmodulename(top) or ""
+        if top.isidentifier():
+            names.add(top)
+    return names
+
+
+class ModuleIndex:
+    """
+    Index of the names of the modules pg!doc can document, built from the
+    metadata of the installed distributions, so that nothing is imported
+    before it is needed
+    """
+
+    def __init__(self, names=()):
+        self.entries = {name: ModuleEntry(name) for name in names}
+
+    def build(self):
+        """
+        Add the top level modules of every installed distribution
+        """
+        for dist in importlib.metadata.distributions():
+            try:
+                names = get_top_level_names(dist)
+            except (OSError, ValueError):
+                continue
+
+            dist_name = dist.metadata["Name"]
+            for name in names:
+                entry = self.entries.get(name)
+                if entry is None:
+                    self.entries[name] = ModuleEntry(name, dist_name)
+                elif entry.distribution is None:
+                    entry.distribution = dist_name
+
+    def get(self, name: str):
+        """
+        Get the entry of a module, or None if the module is not known.
+        Modules that are already imported are always known
+        """
+        entry = self.entries.get(name)
+        if entry is None and name in sys.modules:
+            entry = self.entries[name] = ModuleEntry(name)
+        return entry
+
+    async def load(self, entry: ModuleEntry):
+        """
+        Get the module of an entry, importing it in a thread the first time.
+        Returns None if the import failed, entry.error has the reason
+        """
+        if entry.module is None and entry.error is None:
+            if entry.name in sys.modules:
+                entry.module = sys.modules[entry.name]
+                entry.import_time = 0.0
+                symbol_index.queue(entry.name, entry.module)
+                return entry.module
+
+            start = time.perf_counter()
+            try:
+                entry.module = await asyncio.get_event_loop().run_in_executor(
+                    None, importlib.import_module, entry.name
+                )
+            except asyncio.CancelledError:
+                # Only the wait was cancelled, the import can be tried again
+                raise
+            except BaseException as exc:
+                # Failed imports are not retried, they would likely fail again.
+                # BaseException is caught too, modules may call sys.exit
+                entry.error = f"{exc.__class__.__name__}: {exc}"
+            entry.import_time = time.perf_counter() - start
 
+            if entry.module is not None:
+                symbol_index.queue(entry.name, entry.module)
 
-for module in pkg_resources.working_set:  # pylint: disable=not-an-iterable
+        return entry.module
+
+
+module_index = ModuleIndex(doc_module_names)
+module_index.build()
+
+
+def get_installed_version(entry: ModuleEntry):
+    """
+    Get the version of the distribution of a module without importing it, or
+    the Python version for modules that come with Python
+    """
+    if entry is not None and entry.distribution is not None:
+        try:
+            return importlib.metadata.version(entry.distribution)
+        except importlib.metadata.PackageNotFoundError:
+            pass
+
+    return sys.version.split()[0]
+
+
+def get_module_version(entry: ModuleEntry, module: types.ModuleType):
+    """
+    Get the version of a module, from the module itself or its distribution
+    """
+    version = getattr(module, "__version__", None)
+    if isinstance(version, str):
+        return version
+
+    return get_installed_version(entry)
+
+
+def get_signature(obj):
+    """
+    Get the signature of a callable as text, or None if it has none
+    """
     try:
-        doc_module_dict[module] = __import__(module.replace("-", "_"))
-    except BaseException:
-        pass
+        return str(inspect.signature(obj))
+    except Exception:
+        return None
 
 
-async def put_main_doc(name, original_msg):
+def get_static_member(obj, name: str):
     """
-    Put main part of the doc into embed(s)
+    Get a member of an object with inspect.getattr_static, so that no
+    properties or module __getattr__ hooks run. Static and class methods are
+    unwrapped to their functions. Raises AttributeError if there's no such
+    member
     """
-    splits = name.split(".")
+    # Modules and classes are looked up in their __dict__ first, which is
+    # what getattr_static ends up doing too, only slower
+    if isinstance(obj, types.ModuleType):
+        dicts = (obj.__dict__,)
+    elif isinstance(obj, type):
+        dicts = tuple(klass.__dict__ for klass in obj.__mro__)
+    else:
+        dicts = ()
+
+    for namespace in dicts:
+        if name in namespace:
+            value = namespace[name]
+            break
+    else:
+        value = inspect.getattr_static(obj, name)
+
+    if isinstance(value, (staticmethod, classmethod)):
+        value = value.__func__
+    return value
+
+
+def categorize_members(obj):
+    """
+    Sort the names of the members of an object into the categories pg!doc
+    lists them in
+    """
+    categories = {
+        "Modules": [],
+        "Types": [],
+        "Functions": [],
+        "Methods": [],
+    }
+
+    formatted_obj_names = {
+        "module": "Modules",
+        "type": "Types",
+        "function": "Functions",
+        "classmethod_descriptor": "Functions",
+        "method_descriptor": "Methods",
+    }
+
+    try:
+        names = dir(obj)
+    except Exception:
+        return categories
+
+    for oname in names:
+        if oname.startswith("__"):
+            continue
+
+        try:
+            modmember = get_static_member(obj, oname)
+        except AttributeError:
+            continue
+
+        if type(modmember).__name__ == "builtin_function_or_method":
+            # Disambiguate into funtion or method
+            obj_type_name = None
+            if isinstance(modmember, types.BuiltinFunctionType):
+                obj_type_name = "Functions"
+            elif isinstance(modmember, types.BuiltinMethodType):
+                obj_type_name = "Methods"
+        else:
+            obj_type_name = formatted_obj_names.get(type(modmember).__name__)
+
+        if obj_type_name is not None:
+            categories[obj_type_name].append(oname)
+
+    return categories
+
+
+# id of an object -> (object, categories). The object is kept so that its id
+# is not reused while it is cached
+member_categories = collections.OrderedDict()
 
+
+def get_member_categories(obj):
+    """
+    Get the categories of the members of an object, cached by its id
+    """
+    cached = member_categories.get(id(obj))
+    if cached is not None and cached[0] is obj:
+        member_categories.move_to_end(id(obj))
+        return cached[1]
+
+    categories = categorize_members(obj)
+    member_categories[id(obj)] = (obj, categories)
+    if len(member_categories) > common.DOC_MEMBER_CACHE_SIZE:
+        member_categories.popitem(last=False)
+    return categories
+
+
+def find_submodule(obj, name: str):
+    """
+    Get the full name of a submodule of a package that is not imported yet,
+    or None if obj has no such submodule. Private submodules like __main__
+    are never found, importing them may run scripts
+    """
+    if (
+        name.startswith("_")
+        or not isinstance(obj, types.ModuleType)
+        or not hasattr(obj, "__path__")
+    ):
+        return None
+
+    full_name = f"{obj.__name__}.{name}"
+    try:
+        spec = importlib.util.find_spec(full_name)
+    except (ImportError, ValueError):
+        return None
+
+    return None if spec is None else full_name
+
+
+def get_member_importing(obj, name: str):
+    """
+    Get a member like get_static_member, importing submodules that are not
+    imported yet. Used when building the snapshot, where imports are fine
+    """
     try:
-        is_builtin = bool(getattr(builtins, splits[0]))
+        return get_static_member(obj, name)
+    except AttributeError:
+        full_name = find_submodule(obj, name)
+        if full_name is None:
+            raise
+
+    return importlib.import_module(full_name)
+
+
+def get_doc_member(obj, name: str):
+    """
+    Get a member of an object without side effects. Submodules are only
+    found if something imported them already, since importing a module runs
+    its code. Raises AttributeError if there's no such member
+    """
+    try:
+        return get_static_member(obj, name)
+    except AttributeError:
+        if not isinstance(obj, types.ModuleType):
+            raise
+
+    module = sys.modules.get(f"{obj.__name__}.{name}")
+    if module is None:
+        raise AttributeError(name)
+    return module
+
+
+def is_constant(obj):
+    """
+    Whether an object is a constant, which pg!doc has no docs for
+    """
+    return isinstance(obj, (int, float, str, dict, list, tuple, bool))
+
+
+SNAPSHOT_SCHEMA = """
+CREATE TABLE modules (
+    name TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    installed TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE texts (
+    id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE symbols (
+    name TEXT PRIMARY KEY,
+    module TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    type_name TEXT NOT NULL,
+    signature TEXT,
+    doc INTEGER REFERENCES texts,
+    members INTEGER NOT NULL REFERENCES texts
+) WITHOUT ROWID;
+"""
+
+
+class SnapshotWriter:
+    """
+    Writes the tables of a snapshot. Docstrings and member lists are shared
+    by many symbols, like inherited methods, so every distinct text is stored
+    once, compressed
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.text_ids = {}
+
+    def get_text_id(self, text: str):
+        """
+        Get the id of a text in the texts table, adding it if needed
+        """
+        text_id = self.text_ids.get(text)
+        if text_id is None:
+            text_id = self.text_ids[text] = len(self.text_ids)
+            self.db.execute(
+                "INSERT INTO texts VALUES (?, ?)",
+                (text_id, zlib.compress(text.encode(), 9)),
+            )
+        return text_id
+
+    def add_symbol(self, name: str, root: str, obj):
+        """
+        Add the row of an object to the symbols table
+        """
+        if is_constant(obj):
+            kind, doc, signature, members = "constant", None, None, {}
+        else:
+            kind, doc = type(obj).__name__, obj.__doc__
+            signature = get_signature(obj)
+            members = categorize_members(obj)
+
+        members = {key: value for key, value in members.items() if value}
+        self.db.execute(
+            "INSERT OR IGNORE INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                name,
+                root,
+                kind,
+                obj.__class__.__name__,
+                signature,
+                self.get_text_id(doc) if isinstance(doc, str) else None,
+                self.get_text_id(json.dumps(members)),
+            ),
+        )
+
+    def add_module(self, root: str, module: types.ModuleType):
+        """
+        Add a module, and everything reachable from it. Builtins are added
+        with "" as root, so that their names have no module part
+        """
+        entry = module_index.get(root) if root else None
+        if entry is None:
+            version = sys.version.split()[0]
+        else:
+            version = get_module_version(entry, module)
+
+        self.db.execute(
+            "INSERT INTO modules VALUES (?, ?, ?)",
+            (root, version, get_installed_version(entry)),
+        )
+
+        if root:
+            self.add_symbol(root, root, module)
+        for name, obj in walk_module(root, module, get_member_importing):
+            self.add_symbol(name, root, obj)
+
+
+def write_snapshot(path: str, roots):
+    """
+    Write the docs of (root, module) pairs into a new SQLite file at path.
+    The file is replaced only once it is complete
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite3.connect(tmp_path)
+    try:
+        db.executescript(SNAPSHOT_SCHEMA)
+        writer = SnapshotWriter(db)
+        for root, module in roots:
+            writer.add_module(root, module)
+
+        db.commit()
+        db.execute("VACUUM")
+    finally:
+        db.close()
+
+    os.replace(tmp_path, path)
+
+
+class DocSnapshot:
+    """
+    Prebuilt docs read from the SQLite file that build_docs.py writes, so
+    that pg!doc serves them without importing their modules. The file is
+    memory mapped, and modules whose installed version is not the one in the
+    snapshot are left to the live lookup
+    """
+
+    def __init__(self, path: str):
+        self.db = None
+        self.modules = {}  # Name -> (version, installed version)
+        self.current = {}
+
+        if not os.path.isfile(path):
+            return
+
+        try:
+            db = sqlite3.connect(
+                f"file:{path}?mode=ro", uri=True, check_same_thread=False
+            )
+            db.execute(f"PRAGMA mmap_size = {common.DOC_SNAPSHOT_MMAP_SIZE}")
+            db.row_factory = sqlite3.Row
+            rows = db.execute("SELECT * FROM modules").fetchall()
+        except sqlite3.Error:
+            return
+
+        self.db = db
+        for row in rows:
+            self.modules[row["name"]] = (row["version"], row["installed"])
+
+    def covers(self, root: str):
+        """
+        Whether the snapshot has up to date docs of a top level module, ""
+        is builtins
+        """
+        if root not in self.current:
+            versions = self.modules.get(root)
+            entry = module_index.get(root) if root else None
+            self.current[root] = (
+                versions is not None
+                and versions[1] == get_installed_version(entry)
+            )
+        return self.current[root]
+
+    def get_version(self, name: str):
+        """
+        Get the version of the module of a dotted name in the snapshot,
+        without reading its record. None if the snapshot has no up to date
+        docs of that module
+        """
+        root = get_root_name(name)
+        if self.db is None or root not in self.modules:
+            return None
+        if not self.covers(root):
+            return None
+        return self.modules[root][0]
+
+    def get_text(self, text_id: int):
+        """
+        Get a text of the texts table, or None for a None id
+        """
+        if text_id is None:
+            return None
+
+        data = self.db.execute(
+            "SELECT data FROM texts WHERE id = ?", (text_id,)
+        ).fetchone()[0]
+        return zlib.decompress(data).decode()
+
+    def get(self, name: str):
+        """
+        Get the docs of a dotted name as a dict, and the version of its
+        module, or None, None if the snapshot has no up to date docs of it
+        """
+        if self.db is None:
+            return None, None
+
+        row = self.db.execute(
+            "SELECT * FROM symbols WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None or not self.covers(row["module"]):
+            return None, None
+
+        record = dict(row)
+        record["doc"] = self.get_text(row["doc"])
+        record["members"] = json.loads(self.get_text(row["members"]))
+        return record, self.modules[row["module"]][0]
+
+    def iter_names(self):
+        """
+        Iterate over the names in the snapshot that are up to date
+        """
+        if self.db is None:
+            return
+
+        for name, module in self.db.execute("SELECT name, module FROM symbols"):
+            if self.covers(module):
+                yield name
+
+
+snapshot = DocSnapshot(common.DOC_SNAPSHOT_PATH)
+
+
+def get_trigrams(name: str):
+    """
+    Get the trigrams of a name, ignoring case. The name is padded so that its
+    start and end make trigrams of their own
+    """
+    name = f"${name.lower()}$"
+    return {name[i:i + 3] for i in range(len(name) - 2)}
+
+
+def walk_module(root: str, module: types.ModuleType, getter):
+    """
+    Get (dotted name, object) pairs of the public names reachable from a
+    module, going into its submodules and the classes of its package, at most
+    common.DOC_INDEX_MAX_DEPTH attributes deep. The objects are read with
+    getter, get_static_member runs no properties and imports no lazy
+    submodules
+    """
+    package = module.__name__.split(".")[0]
+    seen = {id(module)}
+    stack = [(root, module, 0)]
+
+    while stack:
+        name, obj, depth = stack.pop()
+        try:
+            attrs = dir(obj)
+        except Exception:
+            continue
+
+        for attr in attrs:
+            if attr.startswith("_"):
+                continue
+
+            try:
+                value = getter(obj, attr)
+            except Exception:
+                continue
+
+            dotted = f"{name}.{attr}" if name else attr
+            yield dotted, value
+
+            if depth + 1 >= common.DOC_INDEX_MAX_DEPTH or id(value) in seen:
+                continue
+
+            if isinstance(value, types.ModuleType):
+                owner = value.__name__
+            elif isinstance(value, type):
+                owner = value.__module__
+            else:
+                continue
+
+            if isinstance(owner, str) and owner.split(".")[0] == package:
+                seen.add(id(value))
+                stack.append((dotted, value, depth + 1))
+
+
+class SymbolIndex:
+    """
+    Index of the dotted names pg!doc can document, for prefix search and for
+    fuzzy search on the trigrams of the last part of the names. The names of
+    the snapshot, and of modules once they are imported, are added in a
+    background task, so the index grows without blocking the bot
+    """
+
+    def __init__(self):
+        self.names = []  # The ids of names are their indices in this list
+        self.ids = {}
+        self.keys = []  # Sorted (lowercase name, id) pairs
+        self.new_keys = []  # Pairs not yet merged into self.keys
+        self.grams = collections.defaultdict(list)
+        self.gram_counts = []
+        self.parts = []  # Lowercase (parent, last part) of every name
+        # Ids of names keyed by their lowercase parent and the first letter
+        # of their last part
+        self.children = collections.defaultdict(list)
+        self.pending = collections.deque()
+        self.queued = set()
+        self.task = None
+
+    @property
+    def building(self):
+        """
+        Whether modules are still being walked
+        """
+        return self.task is not None and not self.task.done()
+
+    def add(self, name: str):
+        """
+        Add a dotted name to the index
+        """
+        if name in self.ids:
+            return
+
+        name_id = len(self.names)
+        self.names.append(name)
+        self.ids[name] = name_id
+
+        parent, _, last = name.rpartition(".")
+        grams = get_trigrams(last)
+        for gram in grams:
+            self.grams[gram].append(name_id)
+        self.gram_counts.append(len(grams))
+        parent, last = parent.lower(), last.lower()
+        self.parts.append((parent, last))
+        self.children[(parent, last[:1])].append(name_id)
+        self.new_keys.append((name.lower(), name_id))
+
+    def flush(self):
+        """
+        Make the names added since the last flush visible to prefix search
+        """
+        if self.new_keys:
+            # Both lists are sorted runs then, which timsort merges in linear
+            # time
+            self.new_keys.sort()
+            self.keys.extend(self.new_keys)
+            self.keys.sort()
+            self.new_keys.clear()
+
+    def start(self):
+        """
+        Add the names of all known modules, and queue the names of the
+        snapshot, builtins and the known modules that are imported already
+        """
+        for name in module_index.entries:
+            self.add(name)
+        self.flush()
+
+        self.queue_names(snapshot.iter_names())
+        self.queue("", builtins)
+        for name in module_index.entries:
+            if name in sys.modules:
+                self.queue(name, sys.modules[name])
+
+    def queue_names(self, names):
+        """
+        Queue an iterable of names to be added, and start the background task
+        if it is not running
+        """
+        self.pending.append(names)
+        if not self.building:
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def queue(self, name: str, module: types.ModuleType):
+        """
+        Queue a module to be walked, under the dotted name it is documented
+        as. Modules in the snapshot are not walked again
+        """
+        if name in self.queued or snapshot.covers(name):
+            return
+
+        self.queued.add(name)
+        self.queue_names(
+            dotted for dotted, _ in walk_module(
+                name, module, get_static_member
+            )
+        )
+
+    async def run(self):
+        """
+        Add the names of the queued sources, the task ends when the queue is
+        empty
+        """
+        count = 0
+        while self.pending:
+            for name in self.pending.popleft():
+                self.add(name)
+                count += 1
+                if count % common.DOC_INDEX_CHUNK == 0:
+                    self.flush()
+                    await asyncio.sleep(0)
+
+            self.flush()
+
+    def search_prefix(self, prefix: str, limit: int):
+        """
+        Get at most limit names that start with a prefix, ignoring case
+        """
+        prefix = prefix.lower()
+        results = []
+        i = bisect.bisect_left(self.keys, (prefix,))
+        while (
+            len(results) < limit
+            and i < len(self.keys)
+            and self.keys[i][0].startswith(prefix)
+        ):
+            results.append(self.names[self.keys[i][1]])
+            i += 1
+        return results
+
+    def search_fuzzy(self, query: str, limit: int, min_score: float):
+        """
+        Get at most limit names whose last part is spelled like the last part
+        of the query. Names in the same parent as the query come first, then
+        the names are ranked by the Dice coefficient of their trigrams, which
+        must be at least min_score. The names in the same parent that start
+        with the same letter are also compared with difflib, which catches
+        swapped letters
+        """
+        parent, _, last = query.lower().rpartition(".")
+        grams = get_trigrams(last)
+
+        counts = collections.Counter()
+        for gram in grams:
+            counts.update(self.grams.get(gram, ()))
+
+        scores = {}
+        min_shared = min_score * len(grams) / 2
+        for name_id, shared in counts.items():
+            if shared >= min_shared:
+                score = 2 * shared / (len(grams) + self.gram_counts[name_id])
+                if score >= min_score:
+                    scores[name_id] = score
+
+        siblings = self.children.get((parent, last[:1]), ()) if parent else ()
+        matcher = difflib.SequenceMatcher(None)
+        matcher.set_seq2(last)
+        best = []  # Heap of the limit best ratios so far
+        for name_id in siblings:
+            # Only names that can make it into the results are compared fully
+            cutoff = best[0] if len(best) >= limit else min_score
+            other = self.parts[name_id][1]
+            # The ratio is at most this, without looking at the letters
+            if 2 * min(len(other), len(last)) < cutoff * (
+                len(other) + len(last)
+            ):
+                continue
+
+            matcher.set_seq1(other)
+            if matcher.quick_ratio() < cutoff:
+                continue
+
+            score = matcher.ratio()
+            if score >= cutoff:
+                scores[name_id] = max(score, scores.get(name_id, 0))
+                if len(best) >= limit:
+                    heapq.heapreplace(best, score)
+                else:
+                    heapq.heappush(best, score)
+
+        ranked = heapq.nsmallest(limit, (
+            (
+                self.parts[name_id][0] != parent,
+                -score,
+                len(self.names[name_id]),
+                name_id,
+            )
+            for name_id, score in scores.items()
+        ))
+        return [self.names[name_id] for *_, name_id in ranked]
+
+    def search(self, query: str, limit: int):
+        """
+        Get at most limit names for a query, the names that start with it
+        first, then the names that are spelled like it
+        """
+        results = self.search_prefix(query, limit)
+        for name in self.search_fuzzy(
+            query, limit, common.DOC_SUGGEST_MIN_SCORE
+        ):
+            if len(results) >= limit:
+                break
+            if name not in results:
+                results.append(name)
+        return results
+
+    def suggest(self, name: str):
+        """
+        Get names that are close to a name that was not found
+        """
+        return [
+            suggestion for suggestion in self.search_fuzzy(
+                name,
+                common.DOC_SUGGEST_LIMIT + 1,
+                common.DOC_SUGGEST_MIN_SCORE,
+            )
+            if suggestion != name
+        ][:common.DOC_SUGGEST_LIMIT]
+
+
+symbol_index = SymbolIndex()
+
+
+def get_suggestion_text(name: str):
+    """
+    Get a "did you mean" line for a name that was not found, or an empty
+    string if nothing close is known
+    """
+    suggestions = symbol_index.suggest(name)
+    if not suggestions:
+        return ""
+
+    return "\nDid you mean " + ", ".join(
+        f"`{suggestion}`" for suggestion in suggestions
+    ) + "?"
+
+
+class DocCache:
+    """
+    LRU cache of the pages of pg!doc, as (title, text) pairs, keyed by the
+    dotted name and the version of its module. Keeps at most max_bytes of
+    text, and counts its hits and misses
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.pages = collections.OrderedDict()
+
+    @staticmethod
+    def get_pages_size(pages: list):
+        """
+        Get the approximate number of bytes that pages take
+        """
+        return sum(len(title) + len(text) for title, text in pages)
+
+    def get(self, key):
+        """
+        Get the pages of a key, or None if they are not cached
+        """
+        pages = self.pages.get(key)
+        if pages is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.pages.move_to_end(key)
+        return pages
+
+    def put(self, key, pages: list):
+        """
+        Store the pages of a key, evicting the least recently used pages to
+        stay within the budget
+        """
+        size = self.get_pages_size(pages)
+        if size > self.max_bytes:
+            return
+
+        if key in self.pages:
+            self.size -= self.get_pages_size(self.pages.pop(key))
+
+        while self.pages and self.size + size > self.max_bytes:
+            _, old_pages = self.pages.popitem(last=False)
+            self.size -= self.get_pages_size(old_pages)
+
+        self.pages[key] = pages
+        self.size += size
+
+
+doc_cache = DocCache(common.DOC_CACHE_BYTES)
+
+
+def get_root_name(name: str):
+    """
+    Get the name of the top level module a dotted name is looked up in, ""
+    for builtins
+    """
+    first = name.split(".")[0]
+    try:
+        is_builtin = bool(getattr(builtins, first))
     except AttributeError:
         is_builtin = False
 
-    if splits[0] not in doc_module_dict and not is_builtin:
+    return "" if is_builtin else first
+
+
+async def get_doc_root(name, original_msg):
+    """
+    Get the objects the docs of a dotted name are looked up from, and the
+    version of the module they come from. Replies with the error and returns
+    None, None if the module is unknown or could not be imported
+    """
+    splits = name.split(".")
+    if not get_root_name(name):
+        return {}, sys.version.split()[0]
+
+    entry = module_index.get(splits[0])
+    if entry is None:
         await embed_utils.replace(
             original_msg,
             "Unknown module!",
-            "No such module was found."
+            "No such module was found." + get_suggestion_text(name)
+        )
+        return None, None
+
+    module = await module_index.load(entry)
+    if module is None:
+        await embed_utils.replace(
+            original_msg,
+            "Module could not be imported!",
+            utils.code_block(entry.error)
         )
-        return None, None, None
+        return None, None
 
-    module_objs = dict(doc_module_dict)
-    obj = None
+    return {splits[0]: module}, get_module_version(entry, module)
 
-    for part in splits:
+
+async def put_main_doc(name, original_msg, root_objs):
+    """
+    Put main part of the doc into pages of (title, text). Returns the object
+    the name refers to and the pages, or None, None if there is none
+    """
+    splits = name.split(".")
+
+    try:
         try:
-            try:
-                obj = getattr(builtins, part)
-            except AttributeError:
-                obj = module_objs[part]
-
-            module_objs = {}
-            for i in dir(obj):
-                module_objs[i] = getattr(obj, i)
-        except KeyError:
-            await embed_utils.replace(
-                original_msg,
-                "Class/function/sub-module not found!",
-                f"There's no such thing here named `{name}`"
-            )
-            return None, None, None
+            obj = getattr(builtins, splits[0])
+        except AttributeError:
+            obj = root_objs[splits[0]]
 
-    if isinstance(obj, (int, float, str, dict, list, tuple, bool)):
+        # Only the members on the path are looked up
+        for part in splits[1:]:
+            obj = get_doc_member(obj, part)
+    except (KeyError, AttributeError):
         await embed_utils.replace(
             original_msg,
-            f"Documentation for `{name}`",
-            f"{name} is a constant with a type of `{obj.__class__.__name__}`"
-            " which does not have documentation."
+            "Class/function/sub-module not found!",
+            f"There's no such thing here named `{name}`"
+            + get_suggestion_text(name)
         )
-        return None, None, None
+        return None, None
+
+    if is_constant(obj):
+        await reply_constant(name, original_msg, obj.__class__.__name__)
+        return None, None
+
+    docs = obj.__doc__ if isinstance(obj.__doc__, str) else ""
+    return obj, split_doc_pages(name, docs, get_signature(obj))
+
+
+async def reply_constant(name, original_msg, type_name):
+    """
+    Reply that a name is a constant, which has no docs
+    """
+    await embed_utils.replace(
+        original_msg,
+        f"Documentation for `{name}`",
+        f"{name} is a constant with a type of `{type_name}`"
+        " which does not have documentation."
+    )
+
+
+def split_doc_pages(name, docs, signature=None):
+    """
+    Split the docstring of a name into pages of (title, text). The signature
+    goes first, unless the docstring starts with it already
+    """
+    splits = name.split(".")
+    if signature is not None and not docs.lstrip().startswith(splits[-1]):
+        docs = f"{splits[-1]}{signature}\n\n{docs}"
 
     header = ""
     if splits[0] == "pygame":
@@ -129,8 +1038,6 @@ async def put_main_doc(name, original_msg):
             doclink += "".join([s + "." for s in splits])[:-1]
         header = "Online documentation: " + doclink + "\n"
 
-    docs = "" if obj.__doc__ is None else obj.__doc__
-
     embeds = []
     lastchar = 0
     cnt = 0
@@ -157,71 +1064,120 @@ async def put_main_doc(name, original_msg):
                     lastchar += 2040
 
         if text:
-            embeds.append(await embed_utils.send_2(
-                None,
-                title=f"Documentation for `{name}`",
-                description=header + utils.code_block(text),
+            embeds.append((
+                f"Documentation for `{name}`",
+                header + utils.code_block(text),
             ))
 
         header = ""
         if cnt >= common.DOC_EMBED_LIMIT:
             break
 
+    return embeds
 
-    return module_objs, name, embeds
+
+def get_category_pages(name, categories: dict):
+    """
+    Get the pages of (title, text) that list the members of a name by
+    category
+    """
+    return [
+        (f"{otype} in `{name}`", utils.code_block('\n'.join(olist)))
+        for otype, olist in categories.items()
+        if olist
+    ]
 
 
 async def put_doc(name, original_msg, msg_invoker, page=0):
     """
     Helper function to get docs
     """
-    module_objs, name, main_embeds = await put_main_doc(name, original_msg)
-    if module_objs is None:
-        return
+    page_embed = await get_doc_embed(name, original_msg, msg_invoker, page)
+    if page_embed is not None:
+        await page_embed.mainloop()
 
-    allowed_obj_names = {
-        "Modules": [],
-        "Types": [],
-        "Functions": [],
-        "Methods": [],
-    }
 
-    formatted_obj_names = {
-        "module": "Modules",
-        "type": "Types",
-        "function": "Functions",
-        "method_descriptor": "Methods",
-    }
+async def get_doc_embed(name, original_msg, msg_invoker, page=0):
+    """
+    Get the PagedEmbed of the docs of a name, without showing it. Replies
+    with the error and returns None if the name can't be documented
+    """
+    # The pages are the same as long as the module is the same version, so
+    # they are only rendered the first time. Names in the snapshot are
+    # documented without importing their module, and their records are only
+    # read when the pages are not cached
+    pages = record = None
+    version = snapshot.get_version(name)
+    if version is not None:
+        pages = doc_cache.get((name, version))
+        if pages is None:
+            record, version = snapshot.get(name)
 
-    for oname, modmember in module_objs.items():
-        if type(modmember).__name__ == "builtin_function_or_method":
-            # Disambiguate into funtion or method
-            obj_type_name = None
-            if isinstance(modmember, types.BuiltinFunctionType):
-                obj_type_name = "Functions"
-            elif isinstance(modmember, types.BuiltinMethodType):
-                obj_type_name = "Methods"
+        # The snapshot has everything of the module that pg!doc documents,
+        # a name it doesn't have is not looked up by importing the module
+        if pages is None and record is None:
+            await embed_utils.replace(
+                original_msg,
+                "Class/function/sub-module not found!",
+                f"There's no such thing here named `{name}`"
+                + get_suggestion_text(name)
+            )
+            return None
+
+    if pages is None and record is None:
+        root_objs, version = await get_doc_root(name, original_msg)
+        if root_objs is None:
+            return None
+        pages = doc_cache.get((name, version))
+
+    if pages is None:
+        if record is not None:
+            pages = await render_snapshot_pages(name, original_msg, record)
         else:
-            obj_type_name = formatted_obj_names.get(type(modmember).__name__)
+            pages = await render_doc_pages(name, original_msg, root_objs)
 
-        if oname.startswith("__") or obj_type_name is None:
-            continue
+        if pages is None:
+            return None
+        doc_cache.put((name, version), pages)
 
-        allowed_obj_names[obj_type_name].append(oname)
+    async def get_page(num):
+        if num >= len(pages):
+            return None
+        title, text = pages[num]
+        return await embed_utils.send_2(None, title=title, description=text)
 
-    embeds = []
+    return embed_utils.PagedEmbed(
+        original_msg, get_page, msg_invoker, f"doc {name}", page, len(pages)
+    )
 
-    for otype, olist in allowed_obj_names.items():
-        if not olist:
-            continue
 
-        embeds.append(await embed_utils.send_2(
-            None,
-            title=f"{otype} in `{name}`",
-            description=utils.code_block('\n'.join(olist)),
-        ))
+async def render_doc_pages(name, original_msg, root_objs):
+    """
+    Render the pages of the docs of a name, as (title, text) pairs. Replies
+    with the error and returns None if the name can't be documented
+    """
+    obj, main_embeds = await put_main_doc(name, original_msg, root_objs)
+    if main_embeds is None:
+        return None
+
+    main_embeds.extend(
+        get_category_pages(name, get_member_categories(obj))
+    )
+    return main_embeds
+
+
+async def render_snapshot_pages(name, original_msg, record):
+    """
+    Render the pages of the docs of a name from its record in the snapshot,
+    like render_doc_pages does from the live object
+    """
+    if record["kind"] == "constant":
+        await reply_constant(name, original_msg, record["type_name"])
+        return None
+
+    pages = split_doc_pages(name, record["doc"] or "", record["signature"])
+    pages.extend(get_category_pages(name, record["members"]))
+    return pages
 
-    main_embeds.extend(embeds)
 
-    page_embed = embed_utils.PagedEmbed(original_msg, main_embeds, msg_invoker, f"doc {name}", page)
-    await page_embed.mainloop()
+embed_utils.page_sources["doc"] = get_doc_embed
@@ -1,12 +1,15 @@
 import asyncio
+import heapq
 import re
+import sqlite3
+import time
 from datetime import datetime
 from collections.abc import Mapping
 
 import discord
 from discord.embeds import EmptyEmbed
 
-from . import common
+from . import common, outbound
 
 
 def recursive_update(old_dict, update_dict):
@@ -59,18 +62,24 @@ def get_fields(messages):
 
 
 class PagedEmbed:
-    def __init__(self, message, pages, caller=None, command=None, start_page=0):
+    def __init__(
+        self, message, pages, caller=None, command=None, start_page=0,
+        page_count=None
+    ):
         """
         Create an embed which can be controlled by reactions. The footer of the
         embeds will be overwritten. If the optional "command" argument
         is set the embed page will be refreshable. The pages argument must
-        have at least one embed.
+        have at least one embed. Pages are only built when they are first
+        shown, and kept after that.
 
         Args:
             message (discord.Message): The message to overwrite.
 
-            pages (list[discord.Embed]): The list of embeds to change
-            pages between
+            pages (Sequence[discord.Embed] | Callable): The embeds to change
+            pages between. Either a list or other sequence, or an async
+            function that takes the index of a page and returns its embed,
+            or None if there is no such page.
 
             caller (discord.Member, optional): The user that can control
             the embed. Defaults to None (everyone can control it).
@@ -79,8 +88,14 @@ class PagedEmbed:
             Defaults to None.
 
             start_page (int, optional): The page to start from. Defaults to 0.
+
+            page_count (int, optional): The number of pages. Needed when pages
+            is a function, where it may be an estimate that is corrected when
+            a page turns out to be missing. Defaults to len(pages).
         """
         self.pages = pages
+        self.page_count = len(pages) if page_count is None else page_count
+        self.built_pages = {}
         self.current_page = start_page
         self.message = message
         self.parent_command = command
@@ -95,12 +110,16 @@ class PagedEmbed:
             "last":  ("", ""),
         }
 
-        if len(self.pages) >= 3:
+        if self.page_count >= 3:
             self.control_emojis["first"] = ("⏪", "Go to the first page")
             self.control_emojis["last"]  = ("⏩", "Go to the last page")
 
 
         self.killed = False
+        self.replaced = False
+        self.done = asyncio.get_event_loop().create_future()
+        self.expires_at = None
+        self.lock = asyncio.Lock()
         self.caller = caller
 
         newline = "\n"
@@ -109,11 +128,34 @@ class PagedEmbed:
             if emoji:
                 self.help_text += f"{emoji}: {desc}{newline}"
 
+    async def get_page(self, num):
+        """
+        Get the embed of a page, building it and stamping its footer the first
+        time. Returns None if the page does not exist
+        """
+        if num in self.built_pages:
+            return self.built_pages[num]
+
+        if callable(self.pages):
+            page = await self.pages(num)
+        else:
+            try:
+                page = self.pages[num]
+            except IndexError:
+                page = None
+
+        if page is not None:
+            if self.page_count > 1:
+                page.set_footer(text=self.get_footer_text(num))
+            self.built_pages[num] = page
+
+        return page
+
     async def add_control_emojis(self):
         """Add the control reactions to the message."""
         for emoji in self.control_emojis.values():
             if emoji[0]:
-                await self.message.add_reaction(emoji[0])
+                await outbound.react(self.message, "add_reaction", emoji[0])
 
     async def handle_reaction(self, reaction):
         """Handle a reaction."""
@@ -127,7 +169,7 @@ class PagedEmbed:
             await self.set_page(0)
 
         if reaction == self.control_emojis.get("last")[0]:
-            await self.set_page(len(self.pages) - 1)
+            await self.set_page(self.page_count - 1)
 
         if reaction == self.control_emojis.get("stop")[0]:
             self.killed = True
@@ -145,27 +187,35 @@ class PagedEmbed:
             )
             footer = self.get_footer_text(self.current_page)
             info_page_embed.set_footer(text=footer)
-            await self.message.edit(embed=info_page_embed)
+            await outbound.edit(self.message, embed=info_page_embed)
         else:
-            await self.message.edit(embed=self.pages[self.current_page])
+            await outbound.edit(
+                self.message, embed=await self.get_page(self.current_page)
+            )
 
     async def set_page(self, num):
         """Set the current page and display it."""
         self.is_on_info = False
-        self.current_page = num % len(self.pages)
-        await self.message.edit(embed=self.pages[self.current_page])
+        self.current_page = num % self.page_count
+        page = await self.get_page(self.current_page)
+        if page is None:
+            # The page count was an estimate, and this page is past the end
+            while page is None and self.current_page > 0:
+                self.page_count = self.current_page
+                self.current_page -= 1
+                page = await self.get_page(self.current_page)
 
-    async def setup(self):
-        if len(self.pages) == 1:
-            await self.message.edit(embed=self.pages[0])
-            return False
+            for i, built_page in self.built_pages.items():
+                built_page.set_footer(text=self.get_footer_text(i))
 
-        for i, page in enumerate(self.pages):
-            footer = self.get_footer_text(i)
+        await outbound.edit(self.message, embed=page)
 
-            page.set_footer(text=footer)
+    async def setup(self):
+        if self.page_count == 1:
+            await outbound.edit(self.message, embed=await self.get_page(0))
+            return False
 
-        await self.message.edit(embed=self.pages[self.current_page])
+        await self.set_page(self.current_page)
         await self.add_control_emojis()
 
         return True
@@ -173,7 +223,7 @@ class PagedEmbed:
     def get_footer_text(self, page_num):
         """Get the information footer text, which contains the current page."""
         newline = "\n"
-        footer = f"Page {page_num+1} of {len(self.pages)}.{newline}"
+        footer = f"Page {page_num+1} of {self.page_count}.{newline}"
 
         if self.parent_command:
             footer += f"Refresh with pg!refresh {self.message.id}{newline}"
@@ -183,10 +233,12 @@ class PagedEmbed:
 
     async def check(self, event):
         """Check if the event from "raw_reaction_add" can be passed down to `handle_rection`"""
-        if event.member.bot:
+        if event.member is None or event.member.bot:
             return False
 
-        await self.message.remove_reaction(str(event.emoji), event.member)
+        await outbound.react(
+            self.message, "remove_reaction", str(event.emoji), event.member
+        )
         if self.caller and self.caller.id != event.user_id:
             for role in event.member.roles:
                 if role.id in common.ADMIN_ROLES:
@@ -194,29 +246,352 @@ class PagedEmbed:
             else:
                 return False
 
-        return event.message_id == self.message.id
+        return True
+
+    async def on_reaction(self, event):
+        """
+        Handle a "raw_reaction_add" event on the message, which the reaction
+        router sends. Events are handled one at a time
+        """
+        async with self.lock:
+            if self.killed or not await self.check(event):
+                return
+
+            await self.handle_reaction(str(event.emoji))
+            if self.killed:
+                self.stop()
+            else:
+                reaction_router.touch(self)
+
+    def stop(self):
+        """Stop handling reactions, which ends the mainloop."""
+        self.killed = True
+        if not self.done.done():
+            self.done.set_result(None)
 
     async def mainloop(self):
-        """Start the mainloop. This checks for reactions and handles them."""
+        """
+        Start the mainloop. The reaction router sends the reactions on the
+        message to this embed until it is stopped, or has had no reactions
+        for common.PAGED_EMBED_TIMEOUT seconds.
+        """
         if not await self.setup():
             return
 
-        while not self.killed:
+        await self.run()
+
+    async def run(self):
+        """
+        Handle reactions until stopped. Unlike mainloop, this does not show
+        the page or add the buttons first, which a resumed embed has already.
+        """
+        reaction_router.add(self)
+        try:
+            await self.done
+        finally:
+            reaction_router.remove(self)
+
+        if not self.replaced:
+            await outbound.react(self.message, "clear_reactions")
+
+
+class PaginatorState:
+    """
+    The stored state of a PagedEmbed. expires_at is None once it has stopped
+    """
+
+    def __init__(
+        self, message_id: int, channel_id: int, command: str, page: int,
+        caller_id: int = None, expires_at: float = None, updated_at: float = 0.0
+    ):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.command = command
+        self.page = page
+        self.caller_id = caller_id
+        self.expires_at = expires_at
+        self.updated_at = updated_at
+
+
+class PaginatorStore:
+    """
+    SQLite store of the states of the PagedEmbeds with a command, so that
+    they keep working after a restart. All states are kept in memory too,
+    the file is only read when the store is opened
+    """
+
+    def __init__(self, path: str, max_rows: int):
+        self.max_rows = max_rows
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS paginators ("
+            "message_id INTEGER PRIMARY KEY, "
+            "channel_id INTEGER NOT NULL, "
+            "command TEXT NOT NULL, "
+            "page INTEGER NOT NULL, "
+            "caller_id INTEGER, "
+            "expires_at REAL, "
+            "updated_at REAL NOT NULL)"
+        )
+        self.db.commit()
+
+        self.states = {
+            row[0]: PaginatorState(*row)
+            for row in self.db.execute("SELECT * FROM paginators")
+        }
+
+    def get(self, message_id: int):
+        """
+        Get the state of the PagedEmbed of a message, or None
+        """
+        return self.states.get(message_id)
+
+    def save(self, state: PaginatorState):
+        """
+        Store a state. The least recently updated states are dropped when
+        there are more than max_rows
+        """
+        state.updated_at = time.time()
+        self.states[state.message_id] = state
+        self.db.execute(
+            "INSERT OR REPLACE INTO paginators VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                state.message_id, state.channel_id, state.command, state.page,
+                state.caller_id, state.expires_at, state.updated_at,
+            ),
+        )
+
+        if len(self.states) > self.max_rows:
+            # Drop a tenth at once, so that this does not run on every save
+            old_states = sorted(
+                self.states.values(), key=lambda state: state.updated_at
+            )[:len(self.states) - self.max_rows * 9 // 10]
+            for old_state in old_states:
+                del self.states[old_state.message_id]
+            self.db.executemany(
+                "DELETE FROM paginators WHERE message_id = ?",
+                ((old_state.message_id,) for old_state in old_states),
+            )
+
+        self.db.commit()
+
+
+class ReactionRouter:
+    """
+    Sends the "raw_reaction_add" events of the bot to the PagedEmbed of the
+    message they are on, so that other reactions wake no PagedEmbed. Also
+    stops PagedEmbeds that had no reactions for a while, with the times they
+    expire at kept in one heap that a single task waits on.
+
+    Once restored from a store, PagedEmbeds that were running when the bot
+    stopped are built again from page_sources when they get a reaction
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.store = None
+        self.paginators = {}  # Message id -> PagedEmbed
+        self.resuming = {}  # Message id -> task that resumes its PagedEmbed
+        self.expiries = []  # Heap of (expiry time, message id)
+        self.task = None
+
+    def restore(self, path: str):
+        """
+        Open the store at path, and wait for reactions on the PagedEmbeds that
+        were running when the bot stopped
+        """
+        if self.store is not None:
+            return
+
+        self.store = PaginatorStore(path, common.PAGINATOR_STORE_MAX_ROWS)
+        for state in self.store.states.values():
+            if state.expires_at is not None:
+                self.push_expiry(state.expires_at, state.message_id)
+
+    def get_state(self, message_id: int):
+        """
+        Get the stored state of the PagedEmbed of a message, or None
+        """
+        return None if self.store is None else self.store.get(message_id)
+
+    def save(self, paginator: PagedEmbed):
+        """
+        Store the state of a PagedEmbed that has a command
+        """
+        if self.store is None or not paginator.parent_command:
+            return
+
+        self.store.save(PaginatorState(
+            paginator.message.id,
+            paginator.message.channel.id,
+            paginator.parent_command,
+            paginator.current_page,
+            None if paginator.caller is None else paginator.caller.id,
+            None if paginator.killed else paginator.expires_at,
+        ))
+
+    def add(self, paginator: PagedEmbed):
+        """
+        Start sending the reactions on the message of a PagedEmbed to it
+        """
+        old = self.paginators.get(paginator.message.id)
+        if old is not None and old is not paginator:
+            # pg!refresh made a new PagedEmbed on the same message, the old
+            # one must not clear its reactions
+            old.replaced = True
+            old.stop()
+
+        self.paginators[paginator.message.id] = paginator
+        self.touch(paginator)
+
+    def remove(self, paginator: PagedEmbed):
+        """
+        Stop sending reactions to a PagedEmbed
+        """
+        if self.paginators.get(paginator.message.id) is paginator:
+            del self.paginators[paginator.message.id]
+            self.save(paginator)
+
+    def touch(self, paginator: PagedEmbed):
+        """
+        Restart the time a PagedEmbed expires after, and store its state.
+        Older heap entries of it are skipped when they come up
+        """
+        paginator.expires_at = time.time() + self.timeout
+        self.push_expiry(paginator.expires_at, paginator.message.id)
+        self.save(paginator)
+
+    def push_expiry(self, expires_at: float, message_id: int):
+        """
+        Add an expiry time to the heap, and start the task if needed
+        """
+        heapq.heappush(self.expiries, (expires_at, message_id))
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def run(self):
+        """
+        Stop PagedEmbeds when they expire, the task ends when none are left
+        """
+        while self.expiries:
+            expires_at, message_id = self.expiries[0]
+            if expires_at > time.time():
+                await asyncio.sleep(expires_at - time.time())
+                continue
+
+            heapq.heappop(self.expiries)
+            paginator = self.paginators.get(message_id)
+            if paginator is not None:
+                if paginator.expires_at <= time.time():
+                    paginator.stop()
+                continue
+
+            state = self.get_state(message_id)
+            if (
+                state is not None
+                and state.expires_at is not None
+                and state.expires_at <= time.time()
+                and message_id not in self.resuming
+            ):
+                await self.expire_state(state)
+
+    def get_message(self, state: PaginatorState):
+        """
+        Get the message of a stored state without fetching it, or None if
+        its channel is gone
+        """
+        channel = common.bot.get_channel(state.channel_id)
+        if channel is None:
+            return None
+        return channel.get_partial_message(state.message_id)
+
+    async def expire_state(self, state: PaginatorState):
+        """
+        Remove the buttons of a PagedEmbed that was running when the bot
+        stopped, and expired without getting a reaction since
+        """
+        state.expires_at = None
+        self.store.save(state)
+
+        message = self.get_message(state)
+        if message is not None:
             try:
-                event = await common.bot.wait_for("raw_reaction_add", timeout=60)
+                await outbound.react(message, "clear_reactions")
+            except discord.HTTPException:
+                pass
 
-                if await self.check(event):
-                    await self.handle_reaction(str(event.emoji))
+    async def resume(self, state: PaginatorState, caller=None):
+        """
+        Build the PagedEmbed of a stored state again, on its page, with the
+        page source of its command. The caller defaults to the stored one.
+        Returns None if it can't be built
+        """
+        command, _, args = state.command.partition(" ")
+        source = page_sources.get(command)
+        message = self.get_message(state)
+        if source is None or message is None:
+            return None
 
-            except asyncio.TimeoutError:
-                self.killed = True
+        if caller is None and state.caller_id is not None:
+            caller = message.guild.get_member(state.caller_id)
+            if caller is None:
+                caller = discord.Object(state.caller_id)
 
-        await self.message.clear_reactions()
+        return await source(args, message, caller, state.page)
 
+    async def resume_running(self, state: PaginatorState):
+        """
+        Resume a PagedEmbed that was running when the bot stopped. Its
+        message shows its page and buttons already, so it only has to start
+        handling reactions again
+        """
+        try:
+            paginator = await self.resume(state)
+            if paginator is not None:
+                asyncio.get_event_loop().create_task(paginator.run())
+            return paginator
+        finally:
+            del self.resuming[state.message_id]
+
+    async def dispatch(self, event: discord.RawReactionActionEvent):
+        """
+        Send a "raw_reaction_add" event to the PagedEmbed of its message, if
+        there is one
+        """
+        paginator = self.paginators.get(event.message_id)
+        if paginator is None:
+            state = self.get_state(event.message_id)
+            if (
+                state is None
+                or state.expires_at is None
+                or state.expires_at <= time.time()
+            ):
+                return
+
+            task = self.resuming.get(event.message_id)
+            if task is None:
+                task = asyncio.get_event_loop().create_task(
+                    self.resume_running(state)
+                )
+                self.resuming[event.message_id] = task
+            paginator = await task
+
+        if paginator is not None:
+            await paginator.on_reaction(event)
 
-async def replace(message, title, description, color=0xFFFFAA, url_image=None, fields=[]):
+
+# Command name -> async function that builds the PagedEmbed of the command
+# from (arguments, message, caller, page), for resuming stored PagedEmbeds
+page_sources = {}
+reaction_router = ReactionRouter(common.PAGED_EMBED_TIMEOUT)
+
+
+async def replace(message, title, description, color=0xFFFFAA, url_image=None, fields=[], priority=outbound.INTERACTIVE):
     """
-    Edits the embed of a message with a much more tight function
+    Edits the embed of a message with a much more tight function. priority is
+    the class the edit is scheduled with
     """
     embed = discord.Embed(title=title, description=description, color=color)
     if url_image:
@@ -225,12 +600,13 @@ async def replace(message, title, description, color=0xFFFFAA, url_image=None, f
     for field in fields:
         embed.add_field(name=field[0], value=field[1], inline=field[2])
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, priority, embed=embed)
 
 
-async def send(channel, title, description, color=0xFFFFAA, url_image=None, fields=[], do_return=False):
+async def send(channel, title, description, color=0xFFFFAA, url_image=None, fields=[], do_return=False, priority=outbound.INTERACTIVE):
     """
-    Sends an embed with a much more tight function
+    Sends an embed with a much more tight function. priority is the class the
+    message is scheduled with
     """
     embed = discord.Embed(title=title, description=description, color=color)
     if url_image:
@@ -242,16 +618,18 @@ async def send(channel, title, description, color=0xFFFFAA, url_image=None, fiel
     if do_return:
         return embed
 
-    return await channel.send(embed=embed)
+    return await outbound.send(channel, priority, embed=embed)
 
 
 async def send_2(
     channel, embed_type="rich", author_name=EmptyEmbed, author_url=EmptyEmbed, author_icon_url=EmptyEmbed, title=EmptyEmbed, url=EmptyEmbed, thumbnail_url=EmptyEmbed,
-    description=EmptyEmbed, image_url=EmptyEmbed, color=0xFFFFAA, fields=[], footer_text=EmptyEmbed, footer_icon_url=EmptyEmbed, timestamp=EmptyEmbed
+    description=EmptyEmbed, image_url=EmptyEmbed, color=0xFFFFAA, fields=[], footer_text=EmptyEmbed, footer_icon_url=EmptyEmbed, timestamp=EmptyEmbed,
+    priority=outbound.INTERACTIVE
 ):
     """
     Sends an embed with a much more tight function. If the channel is
-    None it will return the embed instead of sending it.
+    None it will return the embed instead of sending it. priority is the
+    class the message is scheduled with.
     """
 
     embed = discord.Embed(title=title, type=embed_type,
@@ -281,15 +659,17 @@ async def send_2(
     if channel is None:
         return embed
 
-    return await channel.send(embed=embed)
+    return await outbound.send(channel, priority, embed=embed)
 
 
 async def replace_2(
     message, embed_type="rich", author_name=EmptyEmbed, author_url=EmptyEmbed, author_icon_url=EmptyEmbed, title=EmptyEmbed, url=EmptyEmbed, thumbnail_url=EmptyEmbed,
-    description=EmptyEmbed, image_url=EmptyEmbed, color=0xFFFFAA, fields=[], footer_text=EmptyEmbed, footer_icon_url=EmptyEmbed, timestamp=EmptyEmbed
+    description=EmptyEmbed, image_url=EmptyEmbed, color=0xFFFFAA, fields=[], footer_text=EmptyEmbed, footer_icon_url=EmptyEmbed, timestamp=EmptyEmbed,
+    priority=outbound.INTERACTIVE
 ):
     """
-    Replaces the embed of a message with a much more tight function
+    Replaces the embed of a message with a much more tight function. priority
+    is the class the edit is scheduled with
     """
     embed = await send_2(
         None,
@@ -309,7 +689,7 @@ async def replace_2(
         timestamp=timestamp
     )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, priority, embed=embed)
 
 
 async def edit_2(
@@ -342,14 +722,14 @@ async def edit_2(
 
     recursive_update(old_embed_dict, update_embed_dict)
 
-    return await message.edit(embed=discord.Embed.from_dict(old_embed_dict))
+    return await outbound.edit(message, embed=discord.Embed.from_dict(old_embed_dict))
 
 
 async def send_from_dict(channel, data):
     """
     Sends an embed from a dictionary with a much more tight function
     """
-    return await channel.send(embed=discord.Embed.from_dict(data))
+    return await outbound.send(channel, embed=discord.Embed.from_dict(data))
 
 
 async def replace_from_dict(message, data):
@@ -357,7 +737,7 @@ async def replace_from_dict(message, data):
     Replaces the embed of a message from a dictionary with a much more tight 
     function
     """
-    return await message.edit(embed=discord.Embed.from_dict(data))
+    return await outbound.edit(message, embed=discord.Embed.from_dict(data))
 
 
 async def edit_from_dict(message, embed, update_embed_dict):
@@ -366,7 +746,7 @@ async def edit_from_dict(message, embed, update_embed_dict):
     """
     old_embed_dict = embed.to_dict()
     recursive_update(old_embed_dict, update_embed_dict)
-    return await message.edit(embed=discord.Embed.from_dict(old_embed_dict))
+    return await outbound.edit(message, embed=discord.Embed.from_dict(old_embed_dict))
 
 
 async def replace_field_from_dict(message, embed, field_dict, index):
@@ -381,7 +761,7 @@ async def replace_field_from_dict(message, embed, field_dict, index):
         inline=field_dict.get("inline", True),
     )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def edit_field_from_dict(message, embed, field_dict, index):
@@ -404,7 +784,7 @@ async def edit_field_from_dict(message, embed, field_dict, index):
         inline=old_field_dict.get("inline", True),
     )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def edit_fields_from_dicts(message, embed: discord.Embed, field_dicts):
@@ -436,7 +816,7 @@ async def edit_fields_from_dicts(message, embed: discord.Embed, field_dicts):
                 inline=old_field_dict.get("inline", True),
             )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def add_field_from_dict(message, embed, field_dict):
@@ -450,7 +830,7 @@ async def add_field_from_dict(message, embed, field_dict):
         inline=field_dict.get("inline", True),
     )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def add_fields_from_dicts(message, embed: discord.Embed, field_dicts):
@@ -465,7 +845,7 @@ async def add_fields_from_dicts(message, embed: discord.Embed, field_dicts):
             inline=field_dict.get("inline", True),
         )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def insert_field_from_dict(message, embed, field_dict, index):
@@ -480,7 +860,7 @@ async def insert_field_from_dict(message, embed, field_dict, index):
         inline=field_dict.get("inline", True),
     )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def insert_fields_from_dicts(message, embed: discord.Embed, field_dicts, index):
@@ -496,7 +876,7 @@ async def insert_fields_from_dicts(message, embed: discord.Embed, field_dicts, i
         inline=field_dict.get("inline", True),
         )
 
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def remove_field(message, embed, index):
@@ -504,7 +884,7 @@ async def remove_field(message, embed, index):
     Removes an embed field of the embed of a message from a dictionary with a much more tight function
     """
     embed.remove_field(index)
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def remove_fields(message, embed, field_indices):
@@ -513,7 +893,7 @@ async def remove_fields(message, embed, field_indices):
     """
     for index in sorted(field_indices, reverse=True):
         embed.remove_field(index)
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
 
 
 async def swap_fields(message, embed, index_a, index_b):
@@ -523,7 +903,7 @@ async def swap_fields(message, embed, index_a, index_b):
     embed_dict = embed.to_dict()
     fields_list = embed_dict["fields"]
     fields_list[index_a], fields_list[index_b] = fields_list[index_b], fields_list[index_a]
-    return await message.edit(embed=discord.Embed.from_dict(embed_dict))
+    return await outbound.edit(message, embed=discord.Embed.from_dict(embed_dict))
 
 
 async def clone_field(message, embed, index):
@@ -533,7 +913,7 @@ async def clone_field(message, embed, index):
     embed_dict = embed.to_dict()
     cloned_field = embed_dict["fields"][index].copy()
     embed_dict["fields"].insert(index, cloned_field)
-    return await message.edit(embed=discord.Embed.from_dict(embed_dict))
+    return await outbound.edit(message, embed=discord.Embed.from_dict(embed_dict))
 
 
 async def clone_fields(message, embed, field_indices, insertion_index=None):
@@ -551,7 +931,7 @@ async def clone_fields(message, embed, field_indices, insertion_index=None):
             cloned_field = embed_dict["fields"][index].copy()
             embed_dict["fields"].insert(index, cloned_field)
 
-    return await message.edit(embed=discord.Embed.from_dict(embed_dict))
+    return await outbound.edit(message, embed=discord.Embed.from_dict(embed_dict))
 
 
 async def clear_fields(message, embed):
@@ -559,4 +939,4 @@ async def clear_fields(message, embed):
     Removes all embed fields of the embed of a message from a dictionary with a much more tight function
     """
     embed.clear_fields()
-    return await message.edit(embed=embed)
+    return await outbound.edit(message, embed=embed)
@@ -0,0 +1,253 @@
+"""
+Scheduler of the messages the bot sends and edits. Every request waits for a
+token of the bucket of its route and of the global bucket, and requests are
+sent in order of priority, so that bulk work like pg!archive yields to the
+replies of commands
+"""
+import asyncio
+import collections
+
+import discord
+
+from . import common
+
+# Priority classes, the lowest is sent first
+INTERACTIVE = 0
+FORWARDING = 1
+LOGS = 2
+BULK = 3
+
+
+class RouteBucket:
+    """
+    Token bucket of a route, that refills limit tokens every period seconds.
+    A rate limited response pauses it for as long as Discord asks
+    """
+
+    def __init__(self, limit: int, period: float):
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.updated = asyncio.get_event_loop().time()
+        self.paused_until = 0.0
+
+    def get_wait(self, now: float, reserve: int = 0):
+        """
+        Get the number of seconds until a token can be taken, with reserve
+        tokens left for others
+        """
+        self.tokens = min(
+            self.limit,
+            self.tokens + (now - self.updated) * self.limit / self.period,
+        )
+        self.updated = now
+
+        if self.paused_until > now:
+            return self.paused_until - now
+
+        missing = 1 + reserve - self.tokens
+        if missing <= 0:
+            return 0.0
+        return missing * self.period / self.limit
+
+    def take(self):
+        """
+        Take a token
+        """
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """
+        Take no tokens for some seconds, and start empty after that
+        """
+        now = asyncio.get_event_loop().time()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+class OutboundJob:
+    """
+    A request waiting in the scheduler
+    """
+
+    def __init__(self, route: tuple, factory):
+        self.route = route
+        self.factory = factory
+        self.future = asyncio.get_event_loop().create_future()
+
+
+def get_retry_after(exc: discord.HTTPException):
+    """
+    Get the seconds a rate limited response asks to wait, from its headers
+    """
+    headers = getattr(exc.response, "headers", None) or {}
+    for header in ("X-RateLimit-Reset-After", "Retry-After"):
+        try:
+            return float(headers[header])
+        except (KeyError, ValueError):
+            pass
+    return 1.0
+
+
+class OutboundScheduler:
+    """
+    Sends requests in order of priority, as fast as the route and global
+    buckets allow. Bulk requests also leave some tokens for the other classes
+    """
+
+    def __init__(
+        self, route_limits: dict, global_limit: tuple, bulk_reserve: int
+    ):
+        self.route_limits = route_limits  # Route kind -> (limit, period)
+        self.global_limit = global_limit
+        self.bulk_reserve = bulk_reserve
+        self.queues = [collections.deque() for _ in range(BULK + 1)]
+        self.buckets = {}
+        self.global_bucket = None
+        self.wakeup = None
+        self.task = None
+
+    def get_bucket(self, route: tuple):
+        """
+        Get the bucket of a route, a (kind, channel id) pair
+        """
+        bucket = self.buckets.get(route)
+        if bucket is None:
+            bucket = self.buckets[route] = RouteBucket(
+                *self.route_limits[route[0]]
+            )
+        return bucket
+
+    async def submit(self, priority: int, route: tuple, factory):
+        """
+        Queue a request, and wait for its result. factory is called to make
+        the coroutine of the request once it is its turn
+        """
+        if self.task is None or self.task.done():
+            self.global_bucket = self.global_bucket or RouteBucket(
+                *self.global_limit
+            )
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+        job = OutboundJob(route, factory)
+        self.queues[priority].append(job)
+        self.wakeup.set()
+        return await job.future
+
+    def pick(self, now: float):
+        """
+        Take the first job of the highest priority that its buckets allow.
+        Returns the job, or None and the seconds until one may be allowed
+        """
+        delay = float("inf")
+        for priority, queue in enumerate(self.queues):
+            bulk = priority == BULK
+            wait = self.global_bucket.get_wait(
+                now, self.bulk_reserve if bulk else 0
+            )
+            if wait:
+                delay = min(delay, wait)
+                continue
+
+            blocked = set()
+            for job in tuple(queue):
+                if job.future.done():
+                    # The caller stopped waiting
+                    queue.remove(job)
+                    continue
+
+                if job.route in blocked:
+                    continue
+
+                bucket = self.get_bucket(job.route)
+                # Bulk requests leave a token of the burst of the route, so
+                # that a reply to a command doesn't wait behind them
+                wait = bucket.get_wait(now, int(bulk and bucket.limit > 1))
+                if not wait:
+                    queue.remove(job)
+                    bucket.take()
+                    self.global_bucket.take()
+                    return job, 0.0
+
+                blocked.add(job.route)
+                delay = min(delay, wait)
+
+        return None, delay
+
+    async def run(self):
+        """
+        Start the jobs as their turns come, the task ends when the queues are
+        empty
+        """
+        loop = asyncio.get_event_loop()
+        while any(self.queues):
+            job, delay = self.pick(loop.time())
+            if job is not None:
+                loop.create_task(self.run_job(job))
+                continue
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_job(self, job: OutboundJob):
+        """
+        Run the request of a job, and pause its route if it was rate limited
+        """
+        try:
+            result = await job.factory()
+        except discord.HTTPException as exc:
+            if exc.status == 429:
+                self.get_bucket(job.route).pause(get_retry_after(exc))
+            if not job.future.done():
+                job.future.set_exception(exc)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as exc:
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+scheduler = OutboundScheduler(
+    common.OUTBOUND_ROUTE_LIMITS,
+    common.OUTBOUND_GLOBAL_LIMIT,
+    common.OUTBOUND_BULK_RESERVE,
+)
+
+
+async def send(channel, priority: int = INTERACTIVE, **kwargs):
+    """
+    Send a message to a channel through the scheduler
+    """
+    return await scheduler.submit(
+        priority, ("send", channel.id), lambda: channel.send(**kwargs)
+    )
+
+
+async def edit(message, priority: int = INTERACTIVE, **kwargs):
+    """
+    Edit a message through the scheduler
+    """
+    return await scheduler.submit(
+        priority, ("edit", message.channel.id), lambda: message.edit(**kwargs)
+    )
+
+
+async def react(message, method: str, *args, priority: int = INTERACTIVE):
+    """
+    Add, remove or clear reactions of a message through the scheduler. method
+    is the name of the method of the message to call
+    """
+    return await scheduler.submit(
+        priority,
+        ("reaction", message.channel.id),
+        lambda: getattr(message, method)(*args),
+    )
@@ -1,21 +1,47 @@
+import ast
 import asyncio
 import builtins
 import cmath
+import cProfile
+import collections
+import hashlib
+import io
 import itertools
+import marshal
 import math
 import multiprocessing
+import multiprocessing.connection
+import os
+import pstats
 import random
 import re
+import signal
+import statistics
 import string
 import sys
 import time
+import timeit
 import traceback
+import tracemalloc
+import types
+import weakref
+import zlib
 
+import numpy
 import psutil
 import pygame.freetype
 import pygame.gfxdraw
+import pygame.surfarray
+import pygame.sysfont
 
-from . import common
+from . import animation, common
+
+try:
+    import resource
+except ImportError:
+    # resource is only available on unix, the sandbox falls back to the
+    # memory monitor for limits there
+    resource = None
 
 
 class Output:
@@ -28,6 +54,273 @@ class Output:
         self.img = None
         self.exc = None
         self.duration = -1  # The script execution time
+        self.truncated = 0  # The number of characters of text that were cut
+        self.completed = False  # Whether the worker finished running the code
+        self.profile = None  # The profile report, when profiling was asked
+        # (loops, trials, min, median, stdev) of every pg!timeit statement
+        self.timings = None
+        self.animation = None  # GIF of output.frames
+        self.dropped_frames = 0  # The number of frames that were cut
+
+
+class OutputBuffer:
+    """
+    Text sink for the sandbox print(). Appends chunks to a list, so printing
+    stays linear time, and keeps at most max_chars characters while counting
+    how many more were written
+    """
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.chunks = []
+        self.size = 0
+        self.truncated = 0
+
+    def write(self, text: str):
+        """
+        Add text to the buffer, cutting off whatever goes over the limit
+        """
+        remaining = self.max_chars - self.size
+        if len(text) > remaining:
+            self.truncated += len(text) - max(remaining, 0)
+            text = text[:max(remaining, 0)]
+
+        if text:
+            self.chunks.append(text)
+            self.size += len(text)
+
+    def clear(self):
+        """
+        Empty the buffer
+        """
+        self.chunks.clear()
+        self.size = 0
+        self.truncated = 0
+
+    def getvalue(self):
+        """
+        Get the text in the buffer
+        """
+        if len(self.chunks) > 1:
+            self.chunks[:] = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+
+# The text buffer and frame recorder behind every SandboxOutput and FrameList.
+# They are kept here rather than on the objects that sandboxed code gets, so
+# that the code can't reach them and change their limits
+output_sinks = weakref.WeakKeyDictionary()
+
+
+class FrameList:
+    """
+    output.frames in the sandbox. Adds frames to a FrameRecorder, without
+    giving out the recorder itself
+    """
+
+    def __init__(self, recorder: animation.FrameRecorder):
+        output_sinks[self] = recorder
+
+    def append(self, surf):
+        output_sinks[self].append(surf)
+
+    def extend(self, surfs):
+        output_sinks[self].extend(surfs)
+
+    def clear(self):
+        output_sinks[self].clear()
+
+    def __len__(self):
+        return len(output_sinks[self])
+
+    @property
+    def duration(self):
+        return output_sinks[self].duration
+
+    @duration.setter
+    def duration(self, value):
+        output_sinks[self].duration = max(int(value), 0)
+
+
+class SandboxOutput(Output):
+    """
+    The output object given to sandboxed code. output.text is backed by an
+    OutputBuffer, so assigning to it and printing both respect the limit.
+    output.frames records frames as they are added, assigning a list of
+    surfaces to it records those
+    """
+
+    def __init__(
+        self, buffer: OutputBuffer, recorder: animation.FrameRecorder
+    ):
+        output_sinks[self] = (buffer, FrameList(recorder))
+        super().__init__()
+
+    @property
+    def text(self):
+        return output_sinks[self][0].getvalue()
+
+    @text.setter
+    def text(self, value):
+        buffer = output_sinks[self][0]
+        buffer.clear()
+        buffer.write(str(value))
+
+    @property
+    def frames(self):
+        return output_sinks[self][1]
+
+    @frames.setter
+    def frames(self, surfs):
+        frames = output_sinks[self][1]
+        frames.clear()
+        frames.extend(surfs)
+
+
+class RawImage:
+    """
+    Raw pixel data of an image made in the sandbox. The pixels are sent over
+    the worker pipe as they are, so that no encoding happens in the worker
+    """
+
+    def __init__(self, surf: pygame.Surface):
+        self.size = surf.get_size()
+        self.flags = surf.get_flags() & pygame.SRCALPHA
+        self.masks = surf.get_masks()
+        self.pixels = b""
+
+    def to_surface(self):
+        """
+        Recreate the surface from the raw pixel data
+        """
+        surf = pygame.Surface(self.size, self.flags, 32, self.masks)
+        surf.get_buffer().write(self.pixels)
+        return surf
+
+
+class EncodedImage:
+    """
+    An image from the sandbox encoded into an in-memory file, ready to upload
+    """
+
+    def __init__(self, buf: io.BytesIO, filename: str, size: tuple):
+        self.buf = buf
+        self.filename = filename
+        self.size = size
+
+
+def save_surface(surf: pygame.Surface, filename: str):
+    """
+    Save a surface into an in-memory file, in the format of the extension of
+    filename
+    """
+    buf = io.BytesIO()
+    pygame.image.save(surf, buf, filename)
+    buf.seek(0)
+    return buf
+
+
+def estimate_png_size(surf: pygame.Surface, step=16):
+    """
+    Estimate the size of a surface as PNG, by compressing every step-th row
+    of it, as it is and as differences to the pixel to the left, like the
+    filters of PNG do
+    """
+    # Copy only the sampled rows, out of a view of the pixels
+    rows = numpy.ascontiguousarray(
+        pygame.surfarray.pixels3d(surf)[:, ::step].swapaxes(0, 1)
+    )
+    diffs = numpy.diff(rows, axis=1, prepend=0)
+    return step * min(
+        len(zlib.compress(rows.tobytes(), 1)),
+        len(zlib.compress(diffs.tobytes(), 1)),
+    )
+
+
+def to_palette(surf: pygame.Surface):
+    """
+    Convert a surface without transparency to an 8 bit surface, when it has
+    256 colors or less. Returns None if it has more
+    """
+    mapped = pygame.surfarray.array2d(surf)
+
+    # Most images with too many colors are caught by a small sample, without
+    # sorting all the pixels
+    sample = mapped.ravel()[::max(mapped.size // 4096, 1)]
+    if len(numpy.unique(sample)) > 256:
+        return None
+
+    colors, indices = numpy.unique(mapped, return_inverse=True)
+    if len(colors) > 256:
+        return None
+
+    surf8 = pygame.Surface(surf.get_size(), 0, 8)
+    surf8.set_palette([surf.unmap_rgb(int(color)) for color in colors])
+    pygame.surfarray.pixels2d(surf8)[...] = indices.reshape(mapped.shape)
+    return surf8
+
+
+def encode_image(img: RawImage, max_bytes=common.EXEC_MAX_IMAGE_BYTES):
+    """
+    Encode an image from the sandbox into an in-memory file of at most
+    max_bytes. Tries PNG first, then a palette PNG for images with 256 colors
+    or less, then JPEG for images without transparency. As a last resort, the
+    image is scaled down and encoded in the format that came closest. Returns
+    None if the image can't be made to fit, or has no pixels at all
+    """
+    if not img.size[0] or not img.size[1]:
+        return None
+
+    surf = img.to_surface()
+    opaque = not img.flags or pygame.surfarray.array_alpha(surf).min() == 255
+    if opaque:
+        # Drop the alpha channel, it makes the PNG bigger for nothing
+        surf24 = pygame.Surface(img.size, 0, 24)
+        surf24.blit(surf, (0, 0))
+        surf = surf24
+
+    attempts = []
+    # Encoding a big PNG takes seconds, don't do it if it won't fit anyways
+    if estimate_png_size(surf) <= 2 * max_bytes:
+        attempts.append((surf, "output.png"))
+    if opaque:
+        attempts.append((to_palette, "output.png"))
+        attempts.append((surf, "output.jpg"))
+
+    closest = None
+    for attempt, filename in attempts:
+        if callable(attempt):
+            attempt = attempt(surf)
+            if attempt is None:
+                continue
+
+        buf = save_surface(attempt, filename)
+        nbytes = buf.getbuffer().nbytes
+        if nbytes <= max_bytes:
+            return EncodedImage(buf, filename, img.size)
+
+        if closest is None or nbytes < closest[0]:
+            closest = (nbytes, filename)
+
+    if closest is None:
+        closest = (estimate_png_size(surf), "output.png")
+
+    nbytes, filename = closest
+    for _ in range(4):
+        # Scale the area down by how much the last attempt was too big, and
+        # a bit more, so that it is likely to fit the next time
+        scale = 0.9 * math.sqrt(max_bytes / nbytes)
+        width, height = surf.get_size()
+        surf = pygame.transform.smoothscale(
+            surf, (max(int(width * scale), 1), max(int(height * scale), 1))
+        )
+
+        buf = save_surface(surf, filename)
+        nbytes = buf.getbuffer().nbytes
+        if nbytes <= max_bytes:
+            return EncodedImage(buf, filename, surf.get_size())
+
+    return None
 
 
 class SandboxFunctionsObject:
@@ -39,11 +332,16 @@ class SandboxFunctionsObject:
     )
 
     def __init__(self):
-        self.output = Output()
+        self.buffer = OutputBuffer(common.EXEC_MAX_OUTPUT)
+        self.recorder = animation.FrameRecorder(
+            common.EXEC_MAX_FRAMES,
+            common.EXEC_MAX_FRAME_BYTES,
+            common.EXEC_FRAME_DURATION,
+        )
+        self.output = SandboxOutput(self.buffer, self.recorder)
 
     def print(self, *values, sep=" ", end="\n"):
-        self.output.text = str(self.output.text)
-        self.output.text += sep.join(map(str, values)) + end
+        self.buffer.write(sep.join(map(str, values)) + end)
 
 
 class PgExecBot(Exception):
@@ -87,6 +385,50 @@ for key in dir(builtins):
         filtered_builtins[key] = getattr(builtins, key)
 
 
+def internal_import(name, globals=None, locals=None, fromlist=(), level=0):
+    """
+    __import__ of the sandbox. C code of numpy and pygame imports its helper
+    modules with the builtins of the calling frame, which is the sandbox one,
+    so let those through if they are already loaded. User code can't name
+    __import__, that is checked when the code is validated
+    """
+    if level == 0 and name in sys.modules and (
+        name.split(".")[0] in common.EXEC_INTERNAL_IMPORTS
+    ):
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    raise ImportError(f"No module named {name!r}")
+
+
+filtered_builtins["__import__"] = internal_import
+
+
+def filter_module(module: types.ModuleType, blocked=(), submodules=()):
+    """
+    Copy the public names of a module into a class for the sandbox, leaving
+    out blocked names and any submodule that isn't listed in submodules
+    """
+    namespace = {"__doc__": module.__doc__}
+    for name in dir(module):
+        if name.startswith("_") or name in blocked:
+            continue
+
+        value = getattr(module, name)
+        if isinstance(value, types.ModuleType):
+            if name not in submodules:
+                continue
+            value = filter_module(value, blocked)
+
+        namespace[name] = value
+
+    return type(module.__name__.split(".")[-1], (), namespace)
+
+
+FilteredNumpy = filter_module(
+    numpy, common.EXEC_NUMPY_BLOCKED, common.EXEC_NUMPY_SUBMODULES
+)
+
+
 class FilteredPygame:
     """
     pygame module in a sandbox
@@ -119,6 +461,24 @@ class FilteredPygame:
         tostring = pygame.image.tostring
         frombuffer = pygame.image.frombuffer
 
+    class surfarray:
+        array2d = pygame.surfarray.array2d
+        pixels2d = pygame.surfarray.pixels2d
+        array3d = pygame.surfarray.array3d
+        pixels3d = pygame.surfarray.pixels3d
+        array_alpha = pygame.surfarray.array_alpha
+        pixels_alpha = pygame.surfarray.pixels_alpha
+        array_red = pygame.surfarray.array_red
+        pixels_red = pygame.surfarray.pixels_red
+        array_green = pygame.surfarray.array_green
+        pixels_green = pygame.surfarray.pixels_green
+        array_blue = pygame.surfarray.array_blue
+        pixels_blue = pygame.surfarray.pixels_blue
+        array_colorkey = pygame.surfarray.array_colorkey
+        make_surface = pygame.surfarray.make_surface
+        blit_array = pygame.surfarray.blit_array
+        map_array = pygame.surfarray.map_array
+
     class font:
         get_default_font = pygame.font.get_default_font
         get_fonts = pygame.font.get_fonts
@@ -148,19 +508,365 @@ for const in pygame.constants.__all__:
     setattr(FilteredPygame.constants, const, pygame.constants.__dict__[const])
     setattr(FilteredPygame, const, pygame.constants.__dict__[const])
 
-def pg_exec(
-    code: str, tstamp: int, allowed_builtins: dict, q: multiprocessing.Queue
+
+# Replacement fields of str.format, and the attribute lookups inside them
+format_field_regex = re.compile(r"\{([^{}]*)\}")
+attribute_regex = re.compile(r"\.\s*(\w+)")
+
+# Nodes of match statement patterns, which only exist from Python 3.10. An
+# empty tuple matches no node on older versions
+match_class_types = getattr(ast, "MatchClass", ())
+match_mapping_types = getattr(ast, "MatchMapping", ())
+match_capture_types = tuple(
+    getattr(ast, name) for name in ("MatchStar", "MatchAs")
+    if hasattr(ast, name)
+)
+
+
+def validate_code(code: str):
+    """
+    Parse pg!exec code and check it for imports and illegal attributes in one
+    pass over the AST, before any worker is involved. Returns the AST, raises
+    PgExecBot pointing at the offending line otherwise
+    """
+    if len(code) > common.EXEC_MAX_CODE_LENGTH:
+        raise PgExecBot(
+            "The code is too long! It can be at most "
+            + f"{common.EXEC_MAX_CODE_LENGTH} characters"
+        )
+
+    try:
+        tree = ast.parse(code, "<string>", "exec")
+    except SyntaxError as e:
+        offsetarrow = " " * (e.offset or 0) + "^\n"
+        raise PgExecBot(f"SyntaxError at line {e.lineno}\n  "
+                        + (e.text or "") + '\n' + offsetarrow + e.msg)
+    except (RecursionError, MemoryError):
+        raise PgExecBot("The code is nested too deeply to be parsed!")
+    except ValueError as e:
+        raise PgExecBot(f"ValueError: {e}")
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            raise PgExecBot(
+                f"Import at line {node.lineno}: Oopsies! The bot's exec "
+                + "function doesn't support importing external modules. Don't "
+                + "worry, many modules are pre-imported for you already! Just "
+                + "re-run your code, without the import statements"
+            )
+
+        if isinstance(node, ast.Attribute):
+            name = node.attr
+        elif isinstance(node, ast.Name):
+            name = node.id
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            name = node.name
+        else:
+            name = None
+
+        # Defining names like __getattr__ or __array_interface__ in a class
+        # is as bad as looking them up
+        if name in common.ILLEGAL_ATTRIBUTES or (
+            isinstance(node, ast.Attribute)
+            and name in common.ILLEGAL_NUMPY_ATTRIBUTES
+        ):
+            raise PgExecBot(
+                f"Suspicious Pattern at line {node.lineno}: "
+                + f"`.{name}` is not allowed"
+            )
+
+        # Class patterns of match statements look up attributes too, like
+        # case object(__class__=cls). The names bound by patterns are checked
+        # the same way, no pattern needs dunder names
+        if isinstance(node, match_class_types):
+            pattern_names = node.kwd_attrs
+        elif isinstance(node, match_mapping_types):
+            pattern_names = (node.rest,)
+        elif isinstance(node, match_capture_types):
+            pattern_names = (node.name,)
+        else:
+            pattern_names = ()
+
+        for pattern_name in pattern_names:
+            if pattern_name is not None and (
+                pattern_name.startswith("__")
+                or pattern_name in common.ILLEGAL_ATTRIBUTES
+                or pattern_name in common.ILLEGAL_NUMPY_ATTRIBUTES
+            ):
+                raise PgExecBot(
+                    f"Suspicious Pattern at line {node.lineno}: "
+                    + f"`{pattern_name}` is not allowed in a match pattern"
+                )
+
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            # Strings can look up attributes through the replacement fields
+            # of str.format, like "{0.__class__}"
+            for field in format_field_regex.findall(node.value):
+                for ill_attr in attribute_regex.findall(field):
+                    if (
+                        ill_attr in common.ILLEGAL_ATTRIBUTES
+                        or ill_attr in common.ILLEGAL_NUMPY_ATTRIBUTES
+                    ):
+                        raise PgExecBot(
+                            f"Suspicious Pattern at line {node.lineno}: "
+                            + f"`.{ill_attr}` is not allowed"
+                        )
+
+    return tree
+
+
+class CompiledCode:
+    """
+    Validated pg!exec code, compiled and marshalled so that it is ready to be
+    sent to workers
+    """
+
+    def __init__(self, key: str, tree: ast.Module):
+        self.key = key
+        try:
+            self.code = marshal.dumps(compile(tree, "<string>", "exec"))
+        except (RecursionError, MemoryError):
+            raise PgExecBot("The code is nested too deeply to be compiled!")
+        except ValueError as e:
+            raise PgExecBot(f"ValueError: {e}")
+
+        # The names of the modules used by the code, that make its results
+        # differ from run to run. Attributes count too, for np.random
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                names.add(node.id)
+            elif isinstance(node, ast.Attribute):
+                names.add(node.attr)
+        self.nondeterministic = frozenset(names.intersection(
+            common.EXEC_NONDETERMINISTIC_NAMES + common.EXEC_UNSEEDED_NAMES
+        ))
+
+    def is_deterministic(self, seed=None):
+        """
+        Whether running this code always gives the same result. Code using
+        the random and np.random functions is deterministic if it runs with a
+        fixed seed, unless it makes its own generators
+        """
+        names = self.nondeterministic
+        if seed is not None:
+            names = names - {"random"}
+        return not names
+
+
+class CodeCache:
+    """
+    LRU cache of compiled pg!exec code, keyed by the hash of the source
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.codes = collections.OrderedDict()
+
+    async def get(self, source: str):
+        """
+        Get the CompiledCode for some source code, validating and compiling it
+        in a thread if it is not cached. Raises PgExecBot for invalid code
+        """
+        key = hashlib.sha256(source.encode()).hexdigest()
+        if key in self.codes:
+            self.codes.move_to_end(key)
+            return self.codes[key]
+
+        self.codes[key] = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: CompiledCode(key, validate_code(source))
+        )
+        if len(self.codes) > self.maxsize:
+            self.codes.popitem(last=False)
+
+        return self.codes[key]
+
+
+class ResultCache:
+    """
+    Cache of the outputs of deterministic pg!exec jobs, so that edited or
+    reposted snippets don't run again. Entries expire after ttl seconds, and
+    the oldest entries are dropped when there are more than maxsize entries or
+    the text and images take more than max_bytes
+    """
+
+    def __init__(self, maxsize: int, ttl: float, max_bytes: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.results = collections.OrderedDict()
+
+    @staticmethod
+    def get_output_size(output: Output):
+        """
+        Get the approximate number of bytes an output takes
+        """
+        size = len(output.text)
+        if output.img is not None:
+            size += len(output.img.pixels)
+        if output.animation is not None:
+            size += len(output.animation)
+        return size
+
+    def pop(self, key):
+        """
+        Remove an entry from the cache
+        """
+        _, output = self.results.pop(key)
+        self.size -= self.get_output_size(output)
+
+    def get(self, key):
+        """
+        Get a cached output, or None if there is no fresh output for the key
+        """
+        if key not in self.results:
+            return None
+
+        stamp, output = self.results[key]
+        if time.monotonic() - stamp > self.ttl:
+            self.pop(key)
+            return None
+
+        self.results.move_to_end(key)
+        return output
+
+    def put(self, key, output: Output):
+        """
+        Store an output in the cache
+        """
+        size = self.get_output_size(output)
+        if self.maxsize <= 0 or size > self.max_bytes:
+            return
+
+        if key in self.results:
+            self.pop(key)
+
+        self.results[key] = (time.monotonic(), output)
+        self.size += size
+        while len(self.results) > self.maxsize or self.size > self.max_bytes:
+            self.pop(next(iter(self.results)))
+
+
+code_cache = CodeCache(common.EXEC_CODE_CACHE_SIZE)
+result_cache = ResultCache(
+    common.EXEC_RESULT_CACHE_SIZE,
+    common.EXEC_RESULT_CACHE_TTL,
+    common.EXEC_RESULT_CACHE_BYTES,
+)
+
+
+def set_resource_limits(max_memory: int):
+    """
+    Set hard kernel limits on the sandbox worker process. The worker is forked
+    from the bot and inherits its memory mappings and open files, so the
+    limits are set on top of what the worker already uses
+    """
+    if resource is None:
+        return
+
+    proc = psutil.Process()
+    vms = proc.memory_info().vms
+
+    resource.setrlimit(resource.RLIMIT_AS, (vms + max_memory,) * 2)
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+
+    nofile = proc.num_fds() + common.EXEC_MAX_FILES
+    resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, nofile))
+
+
+def set_cpu_limit(seconds: float):
+    """
+    Set the CPU time limit for the next job of a sandbox worker. The kernel
+    kills the worker with SIGXCPU when it goes over the limit
+    """
+    if resource is None:
+        return
+
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(time.process_time() + seconds)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def create_cgroup(pid: int, max_memory: int):
+    """
+    Put a sandbox worker in its own cgroup v2 group with a memory.max limit.
+    Only used when EXEC_CGROUP points to a cgroup directory delegated to the
+    bot. Returns the path of the new group, or None if it was not created.
+    """
+    if not common.EXEC_CGROUP:
+        return None
+
+    path = os.path.join(common.EXEC_CGROUP, f"pgexec-{pid}")
+    try:
+        os.mkdir(path)
+        with open(os.path.join(path, "memory.max"), "w") as f:
+            f.write(str(max_memory))
+        with open(os.path.join(path, "cgroup.procs"), "w") as f:
+            f.write(str(pid))
+    except OSError:
+        remove_cgroup(path)
+        return None
+
+    return path
+
+
+def remove_cgroup(path: str):
+    """
+    Remove the cgroup of a sandbox worker, after the worker exited
+    """
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
+
+
+font_index = None
+
+
+def get_font_index():
+    """
+    Get the system font index, marshalled so that it can be handed to workers.
+    pygame scans the system fonts (with fc-list on unix) on the first font
+    lookup of every process, so the scan is done once here, in the bot
+    """
+    global font_index
+    if font_index is None:
+        pygame.sysfont.initsysfonts()
+        font_index = marshal.dumps(
+            (pygame.sysfont.Sysfonts, pygame.sysfont.Sysalias)
+        )
+    return font_index
+
+
+def load_font_index(index: bytes):
+    """
+    Install a font index made by get_font_index in pygame.sysfont, so that
+    font lookups in the worker don't scan the system fonts again
+    """
+    sysfonts, sysalias = marshal.loads(index)
+    pygame.sysfont.Sysfonts.clear()
+    pygame.sysfont.Sysfonts.update(sysfonts)
+    pygame.sysfont.Sysalias.clear()
+    pygame.sysfont.Sysalias.update(sysalias)
+    pygame.sysfont.is_init = True
+
+
+def worker_main(
+    conn, allowed_builtins: dict, max_memory: int, font_index: bytes
 ):
     """
-    exec wrapper used for pg!exec, runs in a seperate process. Since this
-    function runs in a seperate Process, keep that in mind if you want to make
-    any changes to this function (that is, do not touch this shit if you don't 
-    know what you are doing)
+    Entry point of a sandbox worker process. Sets up the sandbox globals once,
+    and then runs pg!exec jobs received over the pipe, until the parent sends
+    None or closes the pipe
     """
-    sandbox_funcs = SandboxFunctionsObject()
-    output = sandbox_funcs.output
+    # SDL installs its own SIGTERM handler, restore the default one so that
+    # the worker can be terminated when the bot exits
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    set_resource_limits(max_memory)
+    load_font_index(font_index)
 
-    allowed_globals = {
+    base_globals = {
         "math": math,
         "cmath": cmath,
         "random": random,
@@ -170,54 +876,228 @@ def pg_exec(
         "itertools": itertools,
     }
 
-    for module in allowed_globals:
-        del allowed_globals[module].__loader__, allowed_globals[module].__spec__
+    for module in base_globals.values():
+        for attr in ("__loader__", "__spec__"):
+            if hasattr(module, attr):
+                delattr(module, attr)
 
-    allowed_globals["__builtins__"] = allowed_builtins
-    allowed_globals["pygame"] = FilteredPygame
-    allowed_globals["output"] = output
+    base_globals["__builtins__"] = allowed_builtins
+    base_globals["pygame"] = FilteredPygame
+    base_globals["numpy"] = base_globals["np"] = FilteredNumpy
+    base_globals.update(allowed_builtins)
+    session_globals = None
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+
+        if job is None:
+            return
+
+        set_cpu_limit(job["timeout"])
+        if job["mode"] == "timeit":
+            output = pg_timeit(
+                job["setup"], job["stmts"], job["timeout"], base_globals
+            )
+            conn.send(output)
+            continue
+
+        if job["seed"] is not None:
+            random.seed(job["seed"])
+            numpy.random.seed(job["seed"] % 2 ** 32)
+
+        if job.get("session"):
+            # Session jobs share their globals with the jobs before them
+            if session_globals is None:
+                session_globals = dict(base_globals)
+            output, img = pg_exec(
+                job["code"], base_globals, job["profile"], session_globals
+            )
+        else:
+            output, img = pg_exec(job["code"], base_globals, job["profile"])
+        conn.send(output)
+        if img is not None:
+            # Send the pixels straight from the surface buffer, without
+            # pickling them
+            conn.send_bytes(img.get_buffer())
+
+
+def get_rss():
+    """
+    Get the resident memory of the current process, in bytes
+    """
+    return psutil.Process().memory_info().rss
 
-    allowed_globals.update(allowed_builtins)
+
+def get_peak_rss():
+    """
+    Get the peak resident memory of the current process over its lifetime,
+    in bytes
+    """
+    if resource is None:
+        return get_rss()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class JobProfiler:
+    """
+    Profiles a pg!exec job inside the worker, with cProfile, the CPU time,
+    peak memory and the number of memory blocks allocated. The peak RSS of a
+    worker includes the bot it was forked from and its earlier jobs, so the
+    growth of RSS over the job is reported instead
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.cpu_time = 0
+        self.blocks = 0
+        self.peak_traced = 0
+        self.rss_growth = 0
+
+    def run(self, code, globals_dict: dict):
+        """
+        exec the code under the profiler
+        """
+        rss_start = get_rss()
+        peak_start = get_peak_rss()
+        tracemalloc.start()
+        self.blocks = sys.getallocatedblocks()
+        self.cpu_time = time.process_time()
+        try:
+            self.profiler.runcall(exec, code, globals_dict)
+        finally:
+            self.cpu_time = time.process_time() - self.cpu_time
+            self.blocks = sys.getallocatedblocks() - self.blocks
+            self.peak_traced = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            # If the job didn't raise the lifetime peak, its own peak is not
+            # known, then the RSS at the end is the closest there is
+            peak = get_peak_rss()
+            rss_end = peak if peak > peak_start else get_rss()
+            self.rss_growth = max(rss_end - rss_start, 0)
+
+    def format(self, top: int):
+        """
+        Format the profile as a compact table of the top functions, by the
+        time spent in the functions themselves
+        """
+        lines = [
+            f"CPU time: {self.cpu_time * 1000:.3f} ms",
+            f"Peak RSS growth: {self.rss_growth} B",
+            f"Peak traced memory: {self.peak_traced} B",
+            f"Memory blocks allocated: {self.blocks:+}",
+            "",
+            f"{'calls':>9} {'own ms':>10} {'total ms':>10}  function",
+        ]
+
+        stats = pstats.Stats(self.profiler).stats
+        rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)
+        rows = [row for row in rows if "_lsprof.Profiler" not in row[0][2]]
+
+        for (filename, lineno, funcname), (_, calls, own, total, _) in rows[:top]:
+            if filename == "<string>":
+                where = f"{funcname} (line {lineno})"
+            elif filename == "~":
+                # Builtin functions have no file
+                where = funcname
+            else:
+                where = f"{funcname} ({os.path.basename(filename)}:{lineno})"
+
+            lines.append(
+                f"{calls:>9} {own * 1000:>10.3f} {total * 1000:>10.3f}  {where}"
+            )
+
+        return "\n".join(lines)
+
+
+def pg_exec(
+    code: bytes, base_globals: dict, profile=False, session_globals=None
+):
+    """
+    exec wrapper used for pg!exec, runs in a sandbox worker process. The code
+    is marshalled code object, that was validated by the bot. The code runs
+    in session_globals when given, otherwise in a copy of base_globals. Since
+    this function runs in a seperate Process, keep that in mind if you want to
+    make any changes to this function (that is, do not touch this shit if you
+    don't know what you are doing)
+    """
+    sandbox_funcs = SandboxFunctionsObject()
+    output = sandbox_funcs.output
+
+    # Every job gets a fresh copy of the globals, so that names defined by one
+    # job are not visible to the next job run by the same worker
+    allowed_globals = session_globals
+    if allowed_globals is None:
+        allowed_globals = dict(base_globals)
+    allowed_globals["output"] = output
 
     for func_name in sandbox_funcs.public_functions:
         allowed_globals[func_name] = getattr(sandbox_funcs, func_name)
 
-    for ill_attr in common.ILLEGAL_ATTRIBUTES:
-        if ill_attr in code:
-            output.exc = PgExecBot("Suspicious Pattern")
-            break
-    else:
-        try:
-            script_start = time.perf_counter()
+    code = marshal.loads(code)
+    profiler = JobProfiler() if profile else None
+    try:
+        script_start = time.perf_counter()
+        if profiler is None:
             exec(code, allowed_globals)
-            output.duration = time.perf_counter() - script_start
+        else:
+            profiler.run(code, allowed_globals)
+        output.duration = time.perf_counter() - script_start
 
-        except ImportError:
-            output.exc = PgExecBot(
-                "Oopsies! The bot's exec function doesn't support importing "
-                + "external modules. Don't worry, many modules are pre-"
-                + "imported for you already! Just re-run your code, without "
-                + "the import statements"
-            )
+    except ImportError:
+        output.exc = PgExecBot(
+            "Oopsies! The bot's exec function doesn't support importing "
+            + "external modules. Don't worry, many modules are pre-"
+            + "imported for you already! Just re-run your code, without "
+            + "the import statements"
+        )
 
-        except SyntaxError as e:
-            offsetarrow = " " * e.offset + "^\n"
-            output.exc = PgExecBot(f"SyntaxError at line {e.lineno}\n  "
-                                   + e.text + '\n' + offsetarrow + e.msg)
+    except MemoryError:
+        output.exc = PgExecBot(
+            f"The bot's memory has taken up to {common.EXEC_MAX_MEMORY} "
+            + "bytes!"
+        )
 
+    except Exception as err:
+        ename = err.__class__.__name__
+        details = err.args[0]
+        # Don't try to replace this, otherwise we may get wrong line numbers
+        lineno = traceback.extract_tb(sys.exc_info()[-1])[-1][1]
+        output.exc = PgExecBot(f"{ename} at line {lineno}: {details}")
+
+    # Encode the animation here rather than in the bot, so that it counts
+    # against the limits of the job
+    gif = None
+    dropped_frames = 0
+    recorder = sandbox_funcs.recorder
+    if recorder.frames:
+        try:
+            gif, dropped_frames = animation.encode_gif(
+                recorder, common.EXEC_MAX_IMAGE_BYTES
+            )
         except Exception as err:
-            ename = err.__class__.__name__
-            details = err.args[0]
-            # Don't try to replace this, otherwise we may get wrong line numbers
-            lineno = traceback.extract_tb(sys.exc_info()[-1])[-1][1]
-            output.exc = PgExecBot(f"{ename} at line {lineno}: {details}")
-
-    # Because output needs to go through queue, we need to sanitize it first
-    # Any random data that gets put in the queue will likely crash the entire
-    # bot
+            output.exc = PgExecBot(
+                f"{err.__class__.__name__} while encoding output.frames: "
+                + str(err)
+            )
+
+    # Because output needs to go through the pipe, we need to sanitize it
+    # first. Any random data that gets sent will likely crash the entire bot
     sanitized_output = Output()
-    if isinstance(output.text, str):
-        sanitized_output.text = output.text
+    sanitized_output.animation = gif
+    sanitized_output.dropped_frames = dropped_frames
+    sanitized_output.completed = True
+    text = sandbox_funcs.buffer.getvalue()
+    sanitized_output.text = text[:common.EXEC_MAX_OUTPUT]
+    sanitized_output.truncated = sandbox_funcs.buffer.truncated + max(
+        len(text) - common.EXEC_MAX_OUTPUT, 0
+    )
 
     if isinstance(output.duration, float):
         sanitized_output.duration = output.duration
@@ -225,43 +1105,732 @@ def pg_exec(
     if isinstance(output.exc, PgExecBot):
         sanitized_output.exc = output.exc
 
-    if isinstance(output.img, pygame.Surface):
-        # A surface is not picklable, so handle differently
-        sanitized_output.img = True
-        pygame.image.save(output.img, f"temp{tstamp}.png")
+    if profiler is not None:
+        sanitized_output.profile = profiler.format(common.EXEC_PROFILE_TOP)
+
+    img = None
+    if isinstance(output.img, pygame.Surface) and 0 in output.img.get_size():
+        if sanitized_output.exc is None:
+            sanitized_output.exc = PgExecBot(
+                "output.img can't be empty, its width and height must be "
+                + "at least 1"
+            )
+
+    elif isinstance(output.img, pygame.Surface):
+        # A surface is not picklable, so its pixels are sent seperately. Blit
+        # it onto a 32 bit surface, so that the pixel format is always one
+        # that the parent can recreate
+        img = pygame.Surface(output.img.get_size(), pygame.SRCALPHA, 32)
+        img.blit(output.img, (0, 0))
+
+        # Don't send and encode more pixels than can be shown anyways
+        width, height = img.get_size()
+        scale = common.EXEC_MAX_IMAGE_SIZE / max(width, height)
+        if scale < 1:
+            img = pygame.transform.smoothscale(
+                img, (max(int(width * scale), 1), max(int(height * scale), 1))
+            )
+
+        sanitized_output.img = RawImage(img)
 
-    q.put(sanitized_output)
+    return sanitized_output, img
 
 
-async def exec_sandbox(code: str, tstamp: int, timeout=5, max_memory=2 ** 28):
+def pg_timeit(setup: str, stmts: list, budget: float, base_globals: dict):
     """
-    Helper to run pg!exec code in a sandbox, manages the seperate process that
-    runs to execute user code.
+    timeit wrapper used for pg!timeit, runs in a sandbox worker process. Every
+    statement gets a loop count picked automatically, and is then timed in
+    repeated trials, which share the time budget with the other statements.
+    The budget is wall clock time, like the timeout of the job and the
+    timings themselves. The code was validated by the bot.
     """
-    q = multiprocessing.Queue(1)
-    proc = multiprocessing.Process(
-        target=pg_exec,
-        args=(code, tstamp, filtered_builtins, q),
-        daemon=True  # the process must die when the main process dies
-    )
-    proc.start()
-    psproc = psutil.Process(proc.pid)
-
-    start = time.perf_counter() # is system-wide and has the highest resolution. 
-    while proc.is_alive():
-        if start + timeout < time.perf_counter():
-            output = Output()
-            output.exc = PgExecBot(f"Hit timeout of {timeout} seconds!")
-            proc.kill()
-            return output
+    sandbox_funcs = SandboxFunctionsObject()
+    output = Output()
+    output.completed = True
+    output.timings = []
 
-        if psproc.memory_info().rss > max_memory:
-            output = Output()
-            output.exc = PgExecBot(
+    allowed_globals = dict(base_globals)
+    allowed_globals["output"] = sandbox_funcs.output
+    for func_name in sandbox_funcs.public_functions:
+        allowed_globals[func_name] = getattr(sandbox_funcs, func_name)
+
+    # Leave some of the budget for setup and sending back the results
+    stmt_budget = budget * 0.8 / len(stmts)
+
+    try:
+        for stmt in stmts:
+            timer = timeit.Timer(stmt, setup, globals=allowed_globals)
+            budget_end = time.perf_counter() + stmt_budget
+
+            # Find a loop count that makes a trial take long enough for the
+            # timer resolution not to matter, while leaving room for at least
+            # common.TIMEIT_MIN_TRIALS trials in the budget. The loop counts
+            # grow in steps of up to 2.5x, so aim at half the trial time
+            trial_time = stmt_budget / (2 * (common.TIMEIT_MIN_TRIALS + 1))
+            for number in (10 ** i * j for i in range(10) for j in (1, 2, 5)):
+                elapsed = timer.timeit(number)
+                if elapsed >= trial_time or time.perf_counter() > budget_end:
+                    break
+
+            trials = [elapsed / number]
+            while (
+                len(trials) < common.TIMEIT_MAX_TRIALS
+                and time.perf_counter() + elapsed < budget_end
+            ):
+                trials.append(timer.timeit(number) / number)
+
+            output.timings.append((
+                number,
+                len(trials),
+                min(trials),
+                statistics.median(trials),
+                statistics.stdev(trials) if len(trials) > 1 else 0.0,
+            ))
+
+    except MemoryError:
+        output.exc = PgExecBot(
+            f"The bot's memory has taken up to {common.EXEC_MAX_MEMORY} "
+            + "bytes!"
+        )
+
+    except Exception as err:
+        # Line numbers are not reported, they point into the timeit template
+        output.exc = PgExecBot(
+            f"{err.__class__.__name__}: " + ", ".join(map(str, err.args))
+        )
+
+    output.text = sandbox_funcs.buffer.getvalue()[:common.EXEC_MAX_OUTPUT]
+    output.truncated = sandbox_funcs.buffer.truncated
+    return output
+
+
+class SandboxWorker:
+    """
+    A pre-started sandbox process, waiting for pg!exec jobs on a pipe
+    """
+
+    def __init__(self, max_memory: int):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.proc = multiprocessing.Process(
+            target=worker_main,
+            args=(
+                child_conn, filtered_builtins, max_memory, get_font_index()
+            ),
+            daemon=True  # the process must die when the main process dies
+        )
+        self.proc.start()
+        child_conn.close()
+
+        self.psproc = psutil.Process(self.proc.pid)
+        self.cgroup = create_cgroup(self.proc.pid, max_memory)
+        self.jobs_done = 0
+        self.exceeded_memory = False
+
+    def kill(self):
+        """
+        Kill the worker process and close its pipe
+        """
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+        if self.cgroup is not None:
+            remove_cgroup(self.cgroup)
+
+    def get_exit_error(self, timeout: float, max_memory: int):
+        """
+        Get the error to report for a worker that exited without replying,
+        based on how it exited
+        """
+        self.proc.join()
+        exitcode = self.proc.exitcode
+
+        # Killed by the memory monitor, or by the kernel OOM killer when the
+        # worker is in a cgroup
+        if self.exceeded_memory or exitcode == -signal.SIGKILL:
+            return PgExecBot(
                 f"The bot's memory has taken up to {max_memory} bytes!"
             )
-            proc.kill()
+
+        if exitcode == -getattr(signal, "SIGXCPU", 0):
+            return PgExecBot(f"Hit CPU time limit of {timeout} seconds!")
+
+        if exitcode == -getattr(signal, "SIGXFSZ", 0):
+            return PgExecBot("Writing to files is not allowed!")
+
+        return PgExecBot(
+            f"The sandbox process exited unexpectedly (code {exitcode})!"
+        )
+
+
+class WorkerPool:
+    """
+    Pool of warm sandbox workers. A worker is thrown away after it has run
+    max_jobs jobs, or when it had to be killed (timeout, memory breach, crash)
+    """
+
+    def __init__(self, size: int, max_jobs: int, max_memory: int):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.idle = collections.deque()
+
+    def fill(self):
+        """
+        Start new workers until the pool has `size` idle workers
+        """
+        while len(self.idle) < self.size:
+            self.idle.append(SandboxWorker(self.max_memory))
+
+    def acquire(self):
+        """
+        Get an idle worker from the pool, starting a new one if the pool has
+        run dry
+        """
+        while self.idle:
+            worker = self.idle.popleft()
+            if worker.proc.is_alive():
+                return worker
+            worker.kill()
+
+        return SandboxWorker(self.max_memory)
+
+    def release(self, worker: SandboxWorker):
+        """
+        Give back a worker that completed a job, recycling it if it is used up
+        """
+        worker.jobs_done += 1
+        if (
+            worker.jobs_done >= self.max_jobs
+            or len(self.idle) >= self.size
+            or not worker.proc.is_alive()
+        ):
+            worker.kill()
+        else:
+            self.idle.append(worker)
+
+
+class SandboxMonitor:
+    """
+    Watches the memory usage of all running sandbox workers from one shared
+    task, killing the workers that go over their memory limit
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.limits = {}
+        self.task = None
+
+    def watch(self, worker: SandboxWorker, max_memory: int):
+        """
+        Start watching a worker that just got a job
+        """
+        self.limits[worker] = max_memory
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def unwatch(self, worker: SandboxWorker):
+        """
+        Stop watching a worker
+        """
+        self.limits.pop(worker, None)
+
+    async def run(self):
+        """
+        Check all watched workers every interval, the task ends when no
+        workers are left to watch
+        """
+        while self.limits:
+            await asyncio.sleep(self.interval)
+            for worker, max_memory in tuple(self.limits.items()):
+                try:
+                    rss = worker.psproc.memory_info().rss
+                except psutil.Error:
+                    # The process died, exec_sandbox handles that
+                    continue
+
+                if rss > max_memory:
+                    worker.exceeded_memory = True
+                    worker.proc.kill()
+
+
+class ExecScheduler:
+    """
+    Admission control for pg!exec jobs. At most max_running jobs run at once,
+    the others wait in per user queues that are served round robin.
+    Privileged users have their own lane, which is always served first.
+    """
+
+    def __init__(self, max_running: int, max_queued: int, max_per_user: int):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.running = 0
+        self.queued = 0
+
+        # The privileged lane and the normal lane, each maps user IDs to
+        # queues of waiting futures, in round robin order
+        self.lanes = (collections.OrderedDict(), collections.OrderedDict())
+
+    def get_lane(self, is_priv: bool):
+        """
+        Get the lane that jobs of a user are queued in
+        """
+        return self.lanes[0] if is_priv else self.lanes[1]
+
+    def iter_waiting(self):
+        """
+        Iterate over the waiting futures, in the order they will be served
+        """
+        for lane in self.lanes:
+            queues = tuple(lane.values())
+            for i in range(max(map(len, queues), default=0)):
+                for queue in queues:
+                    if i < len(queue):
+                        yield queue[i]
+
+    def get_position(self, fut: asyncio.Future):
+        """
+        Get the 1-based queue position of a waiting future
+        """
+        for pos, waiting in enumerate(self.iter_waiting(), 1):
+            if waiting is fut:
+                return pos
+        return 0
+
+    def remove(self, lane: collections.OrderedDict, user_id: int, fut):
+        """
+        Remove a future that stopped waiting from its queue
+        """
+        queue = lane.get(user_id)
+        if queue is not None and fut in queue:
+            queue.remove(fut)
+            self.queued -= 1
+            if not queue:
+                del lane[user_id]
+
+    async def acquire(self, user_id: int, is_priv: bool, on_queued=None):
+        """
+        Wait for a free slot to run a job in. Raises PgExecBot if the job can't
+        be queued. on_queued is an optional coroutine function, called with
+        the queue position when the job has to wait.
+        """
+        if self.running < self.max_running and not self.queued:
+            self.running += 1
+            return
+
+        lane = self.get_lane(is_priv)
+        if self.queued >= self.max_queued:
+            raise PgExecBot(
+                "The bot is running too much code right now, please try again "
+                + "in a bit!"
+            )
+
+        if len(lane.get(user_id, ())) >= self.max_per_user:
+            raise PgExecBot(
+                "You already have too much code waiting to run, please wait "
+                + "for it to finish!"
+            )
+
+        fut = asyncio.get_event_loop().create_future()
+        lane.setdefault(user_id, collections.deque()).append(fut)
+        self.queued += 1
+
+        try:
+            if on_queued is not None:
+                await on_queued(self.get_position(fut))
+            await fut
+        except BaseException:
+            self.remove(lane, user_id, fut)
+            if fut.done() and not fut.cancelled():
+                # We were already handed a slot, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        """
+        Free the slot of a job that finished, handing it to the next waiting
+        job if any
+        """
+        for lane in self.lanes:
+            while lane:
+                user_id, queue = next(iter(lane.items()))
+                fut = queue.popleft()
+                self.queued -= 1
+
+                # Move the user to the back of the lane, for round robin
+                del lane[user_id]
+                if queue:
+                    lane[user_id] = queue
+
+                if not fut.done():
+                    # The slot is handed over, so running stays the same
+                    fut.set_result(None)
+                    return
+
+        self.running -= 1
+
+
+class Session:
+    """
+    A pg!session of a user: a worker that keeps the globals of the code run
+    in it, and the lock that makes its jobs run one at a time
+    """
+
+    def __init__(self, max_memory: int):
+        self.worker = SandboxWorker(max_memory)
+        self.lock = asyncio.Lock()
+        self.timer = None  # Closes the session when it has been idle too long
+
+
+class SessionManager:
+    """
+    The open pg!session sessions, at most one per user. A session is closed
+    when it has not been used for idle_timeout seconds, and the least recently
+    used idle session is closed when a new one would go over max_sessions
+    """
+
+    def __init__(self, max_sessions: int, idle_timeout: float, max_memory: int):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_memory = max_memory
+        self.sessions = collections.OrderedDict()
+
+    def open(self, user_id: int):
+        """
+        Get the session of a user, opening one if there is none. Raises
+        PgExecBot if too many sessions are busy to make room for a new one
+        """
+        session = self.sessions.get(user_id)
+        if session is not None and session.worker.proc.is_alive():
+            self.sessions.move_to_end(user_id)
+            return session
+
+        self.close(user_id)
+        while len(self.sessions) >= self.max_sessions:
+            for other_id, other in self.sessions.items():
+                if not other.lock.locked():
+                    self.close(other_id)
+                    break
+            else:
+                raise PgExecBot(
+                    "Too many sessions are running code right now, try again "
+                    + "in a bit!"
+                )
+
+        session = Session(self.max_memory)
+        self.sessions[user_id] = session
+        return session
+
+    def close(self, user_id: int):
+        """
+        Close the session of a user, if there is one
+        """
+        session = self.sessions.pop(user_id, None)
+        if session is None:
+            return False
+
+        if session.timer is not None:
+            session.timer.cancel()
+        session.worker.kill()
+        return True
+
+    def start_timer(self, user_id: int, session):
+        """
+        Close the session of a user once it has been idle for long enough
+        """
+        session.timer = asyncio.get_event_loop().call_later(
+            self.idle_timeout, self.close, user_id
+        )
+
+    async def run(
+        self, user_id: int, job: dict, is_priv=False, on_queued=None
+    ):
+        """
+        Run a job in the session of a user. The job waits for the session to
+        be free before it waits for the scheduler, so that the jobs of one
+        session don't hold more than one scheduler slot. A session whose
+        worker had to be killed is closed, along with its globals
+        """
+        while True:
+            session = self.open(user_id)
+            async with session.lock:
+                # The session could have been closed while the job waited for
+                # the lock, then it runs in a new one
+                if self.sessions.get(user_id) is not session:
+                    continue
+
+                if session.timer is not None:
+                    session.timer.cancel()
+
+                # However the job ends, even if it is cancelled or
+                # on_queued fails, a session that is still open gets its idle
+                # timer back
+                try:
+                    await exec_scheduler.acquire(user_id, is_priv, on_queued)
+                    try:
+                        output = await run_on_worker(
+                            session.worker, job, self.max_memory
+                        )
+                    finally:
+                        exec_scheduler.release()
+
+                    if not output.completed:
+                        self.close(user_id)
+                        output.exc = PgExecBot(
+                            f"{output.exc.args[0]}\nThe session was closed, "
+                            + "its globals are lost"
+                        )
+                    return output
+                finally:
+                    if self.sessions.get(user_id) is session:
+                        self.start_timer(user_id, session)
+
+
+worker_pool = WorkerPool(
+    common.EXEC_POOL_SIZE, common.EXEC_WORKER_MAX_JOBS, common.EXEC_MAX_MEMORY
+)
+sandbox_monitor = SandboxMonitor(common.EXEC_MONITOR_INTERVAL)
+exec_scheduler = ExecScheduler(
+    common.EXEC_MAX_RUNNING,
+    common.EXEC_MAX_QUEUED,
+    common.EXEC_MAX_QUEUED_PER_USER,
+)
+session_manager = SessionManager(
+    common.EXEC_MAX_SESSIONS,
+    common.EXEC_SESSION_IDLE_TIMEOUT,
+    common.EXEC_SESSION_MAX_MEMORY,
+)
+
+
+async def wait_for_worker(worker: SandboxWorker, timeout: float):
+    """
+    Wait until a worker replies on its pipe or exits, without polling.
+    Returns False if the timeout was hit first.
+    """
+    loop = asyncio.get_event_loop()
+    fut = loop.create_future()
+
+    def wake():
+        if not fut.done():
+            fut.set_result(True)
+
+    fds = (worker.conn.fileno(), worker.proc.sentinel)
+    try:
+        for fd in fds:
+            loop.add_reader(fd, wake)
+    except NotImplementedError:
+        # Event loops without add_reader support (like the proactor loop on
+        # Windows), wait in a thread instead
+        ready = await loop.run_in_executor(
+            None,
+            multiprocessing.connection.wait,
+            (worker.conn, worker.proc.sentinel),
+            timeout
+        )
+        return bool(ready)
+
+    try:
+        await asyncio.wait_for(fut, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        for fd in fds:
+            loop.remove_reader(fd)
+
+
+async def run_on_worker(worker: SandboxWorker, job: dict, max_memory: int):
+    """
+    Send a job (the marshalled code and its options) to a worker and manage
+    the worker while it executes user code. A worker that doesn't reply
+    properly is killed, and the output has the error, with completed False
+    """
+    timeout = job["timeout"]
+    worker.conn.send(job)
+
+    # Without kernel limits, memory has to be checked by the monitor
+    if resource is None and worker.cgroup is None:
+        sandbox_monitor.watch(worker, max_memory)
+    try:
+        replied = await wait_for_worker(worker, timeout)
+    finally:
+        sandbox_monitor.unwatch(worker)
+
+    # The worker could have replied right before it died, so check the pipe
+    # rather than the process. The pipe also polls ready when the worker
+    # died without replying, then reading it hits the end of the pipe
+    if replied and worker.conn.poll():
+        try:
+            output = worker.conn.recv()
+            if output.img is not None:
+                output.img.pixels = worker.conn.recv_bytes()
+        except EOFError:
+            # The worker died before or while sending the output
+            pass
+        else:
             return output
-        await asyncio.sleep(0.05)  # Let the bot do other async things
 
-    return q.get()
+    output = Output()
+    if replied:
+        output.exc = worker.get_exit_error(timeout, max_memory)
+    else:
+        output.exc = PgExecBot(f"Hit timeout of {timeout} seconds!")
+
+    worker.kill()
+    return output
+
+
+async def run_in_worker(job: dict, max_memory: int):
+    """
+    Run a job in a warm worker process from the pool
+    """
+    worker = worker_pool.acquire()
+    try:
+        output = await run_on_worker(worker, job, max_memory)
+    finally:
+        # Replace the worker we took once the result is handed back, starting
+        # a process blocks the event loop for a bit and would delay the result
+        asyncio.get_event_loop().call_soon(worker_pool.fill)
+
+    if output.completed:
+        worker_pool.release(worker)
+    return output
+
+
+async def schedule_job(
+    job: dict, max_memory: int, user_id: int, is_priv: bool, on_queued
+):
+    """
+    Wait for the scheduler to admit a job, and then run it in a worker
+    """
+    try:
+        await exec_scheduler.acquire(user_id, is_priv, on_queued)
+    except PgExecBot as exc:
+        output = Output()
+        output.exc = exc
+        return output
+
+    try:
+        return await run_in_worker(job, max_memory)
+    finally:
+        exec_scheduler.release()
+
+
+async def exec_sandbox(
+    code: str,
+    timeout=5,
+    max_memory=common.EXEC_MAX_MEMORY,
+    user_id=0,
+    is_priv=False,
+    on_queued=None,
+    seed=None,
+    profile=False,
+    cache=False,
+):
+    """
+    Helper to run pg!exec code in a sandbox. Invalid code is rejected right
+    away, valid code waits for the scheduler to admit it. See
+    ExecScheduler.acquire for on_queued. If seed is given, random is seeded
+    with it before the code runs. If profile is True, the code runs under a
+    profiler and the report is put in output.profile.
+
+    If cache is True, results of code that looks deterministic are served
+    from the result cache, except when profiling. Only the names the code
+    uses are checked, so this is opt in.
+    """
+    try:
+        compiled = await code_cache.get(code)
+    except PgExecBot as exc:
+        output = Output()
+        output.exc = exc
+        return output
+
+    cache_key = None
+    if cache and compiled.is_deterministic(seed) and not profile:
+        cache_key = (compiled.key, timeout, seed)
+        output = result_cache.get(cache_key)
+        if output is not None:
+            return output
+
+    job = {
+        "mode": "exec",
+        "code": compiled.code,
+        "timeout": timeout,
+        "seed": seed,
+        "profile": profile,
+    }
+    output = await schedule_job(job, max_memory, user_id, is_priv, on_queued)
+
+    # Only cache outputs that the code made itself, not timeouts and crashes
+    if cache_key is not None and output.completed:
+        result_cache.put(cache_key, output)
+
+    return output
+
+
+async def exec_session(
+    code: str,
+    timeout=5,
+    user_id=0,
+    is_priv=False,
+    on_queued=None,
+):
+    """
+    Helper to run pg!session code in the session of a user, opening one if
+    needed. Session jobs go through the scheduler like other jobs, but never
+    use the result cache, since their results depend on the code before them
+    """
+    try:
+        compiled = await code_cache.get(code)
+    except PgExecBot as exc:
+        output = Output()
+        output.exc = exc
+        return output
+
+    job = {
+        "mode": "exec",
+        "code": compiled.code,
+        "timeout": timeout,
+        "seed": None,
+        "profile": False,
+        "session": True,
+    }
+    try:
+        return await session_manager.run(user_id, job, is_priv, on_queued)
+    except PgExecBot as exc:
+        output = Output()
+        output.exc = exc
+        return output
+
+
+async def timeit_sandbox(
+    setup: str,
+    stmts: list,
+    timeout=5,
+    max_memory=common.EXEC_MAX_MEMORY,
+    user_id=0,
+    is_priv=False,
+    on_queued=None,
+):
+    """
+    Helper to time statements in a sandbox for pg!timeit. The timeout is
+    also the time budget shared by all the statements, output.timings
+    has the results of every statement
+    """
+    try:
+        for code in (setup, *stmts):
+            await asyncio.get_event_loop().run_in_executor(
+                None, validate_code, code
+            )
+    except PgExecBot as exc:
+        output = Output()
+        output.exc = exc
+        return output
+
+    job = {
+        "mode": "timeit",
+        "setup": setup,
+        "stmts": stmts,
+        "timeout": timeout,
+    }
+    return await schedule_job(job, max_memory, user_id, is_priv, on_queued)
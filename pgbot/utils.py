@@ -135,6 +135,77 @@ def get_doc_from_docstr(string, regex):
     return data
 
 
+# If you add a new "section" to this regex dont forget the "|" at the end
+# Does not have to be in the same order in the docs as in here.
+help_regex = re.compile(
+    r"(->type|"
+    r"->signature|"
+    r"->description|"
+    r"->example command|"
+    r"->extended description\n|"
+    r"\Z)|(((?!->).|\n)*)"
+)
+
+
+async def get_help_embed(original_msg, invoker, functions, page=0):
+    """
+    Get the PagedEmbed of the general help message, with a page for every
+    type of command, without showing it
+    """
+    regex = help_regex
+    newline = "\n"
+    fields = {}
+
+    for func_name in functions:
+        docstring = functions[func_name].__doc__
+        data = get_doc_from_docstr(docstring, regex)
+        if not data:
+            continue
+
+        if not fields.get(data["type"]):
+            fields[data["type"]] = ["", "", True]
+
+        fields[data["type"]][0] += f"{data['signature'][2:]}{newline}"
+        fields[data["type"]][1] += (
+            f"`{data['signature']}`{newline}"
+            f"{data['description']}{newline*2}"
+        )
+
+    fields_cpy = fields.copy()
+
+    for field_name in fields:
+        value = fields[field_name]
+        value[1] = f"```{value[0]}```{newline*2}{value[1]}"
+        value[0] = f"__**{field_name}**__"
+
+    fields = fields_cpy
+
+    field_list = list(fields.values())
+
+    async def get_page(num):
+        if num >= len(field_list):
+            return None
+
+        field = field_list[num]
+        body = common.BOT_HELP_PROMPT["body"] + \
+            "\n" + field[0] + "\n\n" + field[1]
+        return await embed_utils.send_2(
+            None,
+            title=common.BOT_HELP_PROMPT["title"],
+            description=body,
+            color=common.BOT_HELP_PROMPT["color"],
+        )
+
+    return embed_utils.PagedEmbed(
+        original_msg,
+        get_page,
+        invoker,
+        "help",
+        page,
+        len(field_list)
+    )
+
+
 async def send_help_message(original_msg, invoker, functions, command=None, page=0):
     """
     Edit original_msg to a help message. If command is supplied it will
@@ -150,65 +221,13 @@ async def send_help_message(original_msg, invoker, functions, command=None, page
         command (str, optional): The command to send the description about.
         Defaults to None.
     """
-    regex = re.compile(
-        # If you add a new "section" to this regex dont forget the "|" at the end
-        # Does not have to be in the same order in the docs as in here.
-        r"(->type|"
-        r"->signature|"
-        r"->description|"
-        r"->example command|"
-        r"->extended description\n|"
-        r"\Z)|(((?!->).|\n)*)"
-    )
+    regex = help_regex
     newline = "\n"
-    fields = {}
 
     if not command:
-        for func_name in functions:
-            docstring = functions[func_name].__doc__
-            data = get_doc_from_docstr(docstring, regex)
-            if not data:
-                continue
-
-            if not fields.get(data["type"]):
-                fields[data["type"]] = ["", "", True]
-
-            fields[data["type"]][0] += f"{data['signature'][2:]}{newline}"
-            fields[data["type"]][1] += (
-                f"`{data['signature']}`{newline}"
-                f"{data['description']}{newline*2}"
-            )
-
-        fields_cpy = fields.copy()
-
-        for field_name in fields:
-            value = fields[field_name]
-            value[1] = f"```{value[0]}```{newline*2}{value[1]}"
-            value[0] = f"__**{field_name}**__"
-
-        fields = fields_cpy
-
-        embeds = []
-        for field in list(fields.values()):
-            body = common.BOT_HELP_PROMPT["body"] + \
-                "\n" + field[0] + "\n\n" + field[1]
-            embeds.append(
-                await embed_utils.send_2(
-                    None,
-                    title=common.BOT_HELP_PROMPT["title"],
-                    description=body,
-                    color=common.BOT_HELP_PROMPT["color"],
-                )
-            )
-
-        page_system = embed_utils.PagedEmbed(
-            original_msg,
-            embeds,
-            invoker,
-            "help",
-            page
+        page_system = await get_help_embed(
+            original_msg, invoker, functions, page
         )
-
         await page_system.mainloop()
 
         return